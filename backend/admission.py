@@ -0,0 +1,145 @@
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+
+from metrics import ADMISSION_INFLIGHT, ADMISSION_REJECTIONS
+
+# Admission control in front of the API. Each request is matched to a rule
+# and charged against a token bucket keyed by (rule, caller); rules for
+# expensive routes also cap how many of their requests run at once in this
+# process. Rejections are immediate 429s with Retry-After, so a caller that
+# hammers one route never queues work ahead of everyone else.
+#
+# Buckets live in memory by default. With the Mongo store every process
+# shares one fixed window per (rule, caller) of burst / rate seconds, which
+# admits the same sustained rate with a single atomic update per request.
+MAX_BUCKETS = 100_000
+
+class Rule:
+    __slots__ = ("name", "pattern", "methods", "rate", "burst", "concurrency")
+
+    def __init__(self, name: str, pattern: str, rate: float, burst: int,
+                 concurrency: Optional[int] = None, methods: Optional[set] = None):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.methods = methods
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+
+    def matches(self, method: str, path: str) -> bool:
+        return (self.methods is None or method in self.methods) and self.pattern.match(path) is not None
+
+class MemoryBuckets:
+    def __init__(self, max_buckets: int = MAX_BUCKETS):
+        # (rule, caller) -> (tokens, updated), least recently updated first
+        self.buckets = OrderedDict()
+        self.max_buckets = max_buckets
+
+    async def take(self, rule: Rule, key: str) -> float:
+        # Returns 0 when admitted, else the seconds until a token is available
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop((rule.name, key), (rule.burst, now))
+        tokens = min(rule.burst, tokens + (now - updated) * rule.rate)
+        admitted = tokens >= 1
+        if admitted:
+            tokens -= 1
+        self.buckets[(rule.name, key)] = (tokens, now)
+        if len(self.buckets) > self.max_buckets:
+            # The stalest bucket has had the longest to refill; dropping it is
+            # O(1) however many callers are active
+            self.buckets.popitem(last=False)
+        return 0.0 if admitted else (1 - tokens) / rule.rate
+
+class MongoBuckets:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def take(self, rule: Rule, key: str) -> float:
+        window = rule.burst / rule.rate
+        now = time.time()
+        window_start = now - now % window
+        counter = await self.collection.find_one_and_update(
+            {"_id": f"{rule.name}:{key}:{int(window_start)}"},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=window * 2)}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if counter["count"] > rule.burst:
+            return window_start + window - now
+        return 0.0
+
+class AdmissionController:
+    def __init__(self, rules: list, default: Rule, identify: Callable, store, prefix: str = "/api"):
+        self.rules = rules
+        self.default = default
+        self.identify = identify
+        self.store = store
+        self.prefix = prefix
+        self.inflight = {rule.name: 0 for rule in rules}
+
+    def match(self, method: str, path: str) -> Rule:
+        for rule in self.rules:
+            if rule.matches(method, path):
+                return rule
+        return self.default
+
+    def reject(self, rule: Rule, reason: str, retry_after: float) -> JSONResponse:
+        ADMISSION_REJECTIONS.labels(rule.name, reason).inc()
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Too many requests"},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    async def __call__(self, request, call_next):
+        path = request.url.path
+        if not path.startswith(self.prefix) or request.method == "OPTIONS":
+            return await call_next(request)
+
+        rule = self.match(request.method, path)
+        try:
+            retry_after = await self.store.take(rule, self.identify(request))
+        except Exception as e:
+            # A shared store outage must not take the API down with it
+            logging.error(f"Admission store unavailable, admitting request: {e}")
+            retry_after = 0.0
+        if retry_after > 0:
+            return self.reject(rule, "rate", retry_after)
+
+        if rule.concurrency is None:
+            return await call_next(request)
+        if self.inflight[rule.name] >= rule.concurrency:
+            return self.reject(rule, "concurrency", 1)
+        self.inflight[rule.name] += 1
+        ADMISSION_INFLIGHT.labels(rule.name).inc()
+        try:
+            response = await call_next(request)
+        except BaseException:
+            self.release(rule)
+            raise
+        # call_next returns as soon as the headers are ready; a streamed body
+        # (exports, receipts) holds the slot until it is sent or abandoned
+        response.body_iterator = self.hold(rule, response.body_iterator)
+        return response
+
+    def release(self, rule: Rule):
+        self.inflight[rule.name] -= 1
+        ADMISSION_INFLIGHT.labels(rule.name).dec()
+
+    async def hold(self, rule: Rule, body):
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            self.release(rule)
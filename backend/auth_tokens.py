@@ -0,0 +1,113 @@
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from jose import JWTError, jwt
+
+# Access-token signing and verification. Tokens carry a `kid` header naming
+# the key that signed them, so keys can be rotated by adding a new key,
+# making it active, and dropping the old one once its tokens have expired.
+# Verified claims are cached by signature until the token expires, and each
+# token's `jti` is checked against an in-memory revocation set that follows
+# the revoked_tokens collection.
+ALGORITHM = "HS256"
+LEGACY_KID = "default"
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+REVOCATION_SYNC_OVERLAP_SECONDS = float(os.environ.get("REVOCATION_SYNC_OVERLAP_SECONDS", "60"))
+
+class SigningKeys:
+    def __init__(self, keys: dict, active_kid: str):
+        if active_kid not in keys:
+            raise ValueError(f"Active signing key {active_kid!r} is not configured")
+        self.keys = keys
+        self.active_kid = active_kid
+
+    @classmethod
+    def from_env(cls, default_secret: str) -> "SigningKeys":
+        # JWT_SIGNING_KEYS="2024-06:secret-a,2024-12:secret-b"; tokens issued
+        # before rotation existed have no kid and verify with SECRET_KEY
+        keys = {LEGACY_KID: default_secret}
+        for entry in os.environ.get("JWT_SIGNING_KEYS", "").split(","):
+            if entry.strip():
+                kid, secret = entry.strip().split(":", 1)
+                keys[kid] = secret
+        return cls(keys, os.environ.get("JWT_ACTIVE_KID", LEGACY_KID))
+
+    def encode(self, claims: dict) -> str:
+        return jwt.encode(claims, self.keys[self.active_kid], algorithm=ALGORITHM, headers={"kid": self.active_kid})
+
+    def decode(self, token: str) -> dict:
+        kid = jwt.get_unverified_header(token).get("kid", LEGACY_KID)
+        secret = self.keys.get(kid)
+        if secret is None:
+            raise JWTError(f"Unknown signing key {kid}")
+        return jwt.decode(token, secret, algorithms=[ALGORITHM])
+
+def token_id(claims: dict) -> Optional[bytes]:
+    try:
+        return uuid.UUID(claims["jti"]).bytes
+    except (KeyError, ValueError, TypeError, AttributeError):
+        return None
+
+class RevocationList:
+    def __init__(self, overlap_seconds: float = REVOCATION_SYNC_OVERLAP_SECONDS):
+        self.revoked = set()
+        self.watermark = None
+        self.overlap = timedelta(seconds=overlap_seconds)
+
+    def __contains__(self, claims: dict) -> bool:
+        jti = token_id(claims)
+        return jti is not None and jti in self.revoked
+
+    def add(self, jti: str):
+        self.revoked.add(uuid.UUID(jti).bytes)
+
+    async def sync(self, revoked_tokens, full: bool = False):
+        # Entries leave Mongo through the TTL index once their token has
+        # expired; a full reload drops them here too. Otherwise entries from
+        # shortly before the watermark on are read: revoked_at comes from the
+        # revoking process's clock, and a write can become visible after a
+        # sync already moved past its timestamp. Re-adding an entry is harmless.
+        now = datetime.now(timezone.utc)
+        if full or self.watermark is None:
+            query = {"expires_at": {"$gt": now}}
+            revoked = set()
+        else:
+            query = {"revoked_at": {"$gte": self.watermark - self.overlap}}
+            revoked = self.revoked
+        watermark = self.watermark if revoked is self.revoked else None
+        async for entry in revoked_tokens.find(query, {"_id": 1, "revoked_at": 1}):
+            revoked.add(uuid.UUID(entry["_id"]).bytes)
+            revoked_at = entry["revoked_at"]
+            if revoked_at.tzinfo is None:
+                revoked_at = revoked_at.replace(tzinfo=timezone.utc)
+            if watermark is None or revoked_at > watermark:
+                watermark = revoked_at
+        self.revoked = revoked
+        self.watermark = watermark or now
+
+class TokenVerifier:
+    def __init__(self, keys: SigningKeys, revocations: RevocationList, cache_size: int = TOKEN_CACHE_SIZE):
+        self.keys = keys
+        self.revocations = revocations
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def verify(self, token: str) -> dict:
+        signature = token.rpartition(".")[2]
+        cached = self.cache.get(signature)
+        if cached is not None and cached[0] == token and cached[1]["exp"] > time.time():
+            self.cache.move_to_end(signature)
+            claims = cached[1]
+        else:
+            claims = self.keys.decode(token)
+            if "exp" in claims:
+                self.cache[signature] = (token, claims)
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        if claims in self.revocations:
+            raise JWTError("Token has been revoked")
+        return claims
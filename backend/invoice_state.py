@@ -0,0 +1,37 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+# Invoice status transitions. Each transition is a single conditional
+# find_one_and_update on the expected current status, so when a manual
+# check and a sweep race on the same invoice exactly one of them wins and
+# gets the updated document back; the others get None.
+PENDING = "pending"
+PAID = "paid"
+
+TRANSITIONS = {
+    PENDING: {PAID},
+}
+
+class InvalidTransition(ValueError):
+    pass
+
+async def transition_invoice(invoices, invoice_id: str, from_status: str, to_status: str, fields: Optional[dict] = None) -> Optional[dict]:
+    if to_status not in TRANSITIONS.get(from_status, set()):
+        raise InvalidTransition(f"Cannot move invoice from {from_status} to {to_status}")
+    
+    return await invoices.find_one_and_update(
+        {"id": invoice_id, "status": from_status},
+        {"$set": {**(fields or {}), "status": to_status}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def mark_invoice_paid(invoices, invoice_id: str, tx_hash: Optional[str], settlement: Optional[dict] = None) -> Optional[dict]:
+    # settlement records which currency/address received a multi-currency payment
+    return await transition_invoice(invoices, invoice_id, PENDING, PAID, {
+        **(settlement or {}),
+        "paid_at": datetime.now(timezone.utc).isoformat(),
+        "tx_hash": tx_hash
+    })
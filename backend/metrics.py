@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+
+from pymongo import monitoring
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import REGISTRY, multiprocess
+
+# Metric objects shared by the API process and the background worker.
+# When running several uvicorn workers set PROMETHEUS_MULTIPROC_DIR so
+# /metrics aggregates samples from every process.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "API request latency by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+MONGO_OPERATION_DURATION = Histogram(
+    "mongo_operation_duration_seconds",
+    "MongoDB command latency by collection and operation",
+    ["collection", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+MONGO_OPERATION_FAILURES = Counter(
+    "mongo_operation_failures_total",
+    "Failed MongoDB commands by collection and operation",
+    ["collection", "operation"],
+)
+
+CHAIN_CHECK_DURATION = Histogram(
+    "chain_check_duration_seconds",
+    "Blockchain provider call latency",
+    ["provider", "currency", "call", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+
+PAYMENT_SWEEP_DURATION = Histogram(
+    "payment_sweep_duration_seconds",
+    "Duration of one pending-payment sweep",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+PAYMENT_SWEEP_BACKLOG = Gauge(
+    "payment_sweep_pending_invoices",
+    "Pending invoices seen by the last payment sweep",
+    multiprocess_mode="livemax",
+)
+
+BCRYPT_POOL_WAIT = Histogram(
+    "bcrypt_pool_wait_seconds",
+    "Time password hashing work waits for a bcrypt pool thread",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+MONGO_POOL_WAIT = Histogram(
+    "mongo_pool_wait_seconds",
+    "Time an operation waits to check a connection out of the MongoDB pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongo_pool_checkout_failures_total",
+    "Failed MongoDB connection checkouts by reason",
+    ["reason"],
+)
+
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "mongo_pool_checked_out_connections",
+    "MongoDB connections currently checked out",
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total",
+    "Requests rejected with 429 by admission rule and reason",
+    ["rule", "reason"],
+)
+
+ADMISSION_INFLIGHT = Gauge(
+    "admission_inflight_requests",
+    "Requests running under an admission concurrency cap",
+    ["rule"],
+    multiprocess_mode="livesum",
+)
+
+def render_metrics():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    # Times every command the driver sends, keyed by collection and command name
+    def __init__(self):
+        self.inflight = {}
+
+    def started(self, event):
+        # getMore names the cursor id in its first field and the collection under "collection"
+        field = "collection" if event.command_name == "getMore" else event.command_name
+        collection = event.command.get(field)
+        if not isinstance(collection, str):
+            collection = "admin"
+        self.inflight[(event.connection_id, event.request_id)] = (collection, time.perf_counter())
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        started = self.inflight.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        collection, _ = started
+        MONGO_OPERATION_DURATION.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        if failed:
+            MONGO_OPERATION_FAILURES.labels(collection, event.command_name).inc()
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    # Motor runs the driver on worker threads and a checkout starts and ends on
+    # the same thread, so the start time is kept per thread
+    def __init__(self):
+        self.local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self.local, "started", None)
+        if started is not None:
+            MONGO_POOL_WAIT.observe(time.perf_counter() - started)
+            self.local.started = None
+        MONGO_POOL_CHECKED_OUT.inc()
+
+    def connection_check_out_failed(self, event):
+        self.local.started = None
+        MONGO_POOL_CHECKOUT_FAILURES.labels(str(event.reason)).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
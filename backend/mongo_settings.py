@@ -0,0 +1,66 @@
+import os
+from typing import Optional
+
+from pymongo import ReadPreference
+from pymongo.read_preferences import Nearest, PrimaryPreferred, Secondary, SecondaryPreferred
+from pymongo.write_concern import WriteConcern
+
+# MongoDB client tuning read from the environment. Anything left unset keeps
+# the driver default, so an empty .env behaves exactly like a bare
+# AsyncIOMotorClient(mongo_url).
+#
+# Reads for lists, exports, search and dashboards go through a database view
+# whose read preference is MONGO_ANALYTICS_READ_PREFERENCE (primary unless
+# configured); writes are split between a durable concern for payment state
+# and revocations and a cheap one for derived data that can be rebuilt.
+CLIENT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_MAX_CONNECTING": ("maxConnecting", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGO_TIMEOUT_MS": ("timeoutMS", int),
+    "MONGO_COMPRESSORS": ("compressors", str),
+    "MONGO_ZLIB_COMPRESSION_LEVEL": ("zlibCompressionLevel", int),
+    "MONGO_APP_NAME": ("appname", str),
+}
+
+READ_PREFERENCES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+def client_options() -> dict:
+    options = {}
+    for env, (option, convert) in CLIENT_OPTIONS.items():
+        value = os.environ.get(env)
+        if value:
+            options[option] = convert(value)
+    return options
+
+def analytics_read_preference():
+    mode = os.environ.get("MONGO_ANALYTICS_READ_PREFERENCE", "primary")
+    if mode == "primary":
+        return ReadPreference.PRIMARY
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown MONGO_ANALYTICS_READ_PREFERENCE {mode!r}")
+    # MongoDB requires at least 90 seconds when a staleness bound is set
+    max_staleness = int(os.environ.get("MONGO_ANALYTICS_MAX_STALENESS_SECONDS", "-1"))
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+def write_concern(env: str, default: str) -> WriteConcern:
+    value = os.environ.get(env, default)
+    w = int(value) if value.isdigit() else value
+    timeout: Optional[int] = int(os.environ.get("MONGO_WRITE_TIMEOUT_MS", "0")) or None
+    return WriteConcern(w=w, wtimeout=timeout if w not in (0, 1) else None)
+
+def durable_write_concern() -> WriteConcern:
+    return write_concern("MONGO_DURABLE_WRITE_CONCERN", "majority")
+
+def cache_write_concern() -> WriteConcern:
+    return write_concern("MONGO_CACHE_WRITE_CONCERN", "1")
@@ -0,0 +1,192 @@
+import time
+import uuid
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Union
+
+# Compact in-memory view of pending invoices for the payment sweep.
+# Invoices are grouped by (currency, address) so each address is queried
+# once per sweep. Per invoice the index keeps only the 16-byte uuid, an
+# 8-byte amount and an 8-byte creation time in flat arrays, about 32 bytes,
+# so a million pending invoices fit in a few tens of MB.
+#
+# CRYPTO invoices can be paid to any of several addresses; they are grouped
+# under ("CRYPTO", ((currency, address), ...)) and their amount stays in the
+# invoice's quote unit, converted at sweep time.
+ID_BYTES = 16
+MULTI_CURRENCY = "CRYPTO"
+
+def group_key(invoice: dict) -> Optional[tuple]:
+    if invoice.get('currency') == MULTI_CURRENCY:
+        addresses = invoice.get('payment_addresses') or {}
+        if not addresses:
+            return None
+        return (MULTI_CURRENCY, tuple(sorted(addresses.items())))
+    address = invoice.get('payment_address')
+    if not address:
+        return None
+    return (invoice['currency'], address)
+
+def created_time(created_at: Union[str, datetime, None]) -> float:
+    if isinstance(created_at, str):
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except ValueError:
+            created_at = None
+    if not isinstance(created_at, datetime):
+        # Unknown age counts as new, so the invoice stays on the fast cadence
+        return time.time()
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.timestamp()
+
+def id_key(invoice_id: str) -> Optional[bytes]:
+    try:
+        return uuid.UUID(invoice_id).bytes
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+class RecheckSchedule:
+    # Invoices pending longer than stale_after seconds are checked once per
+    # stale_interval instead of on every sweep. Each id has a fixed phase in
+    # the interval and is due in the one sweep window that covers it, so the
+    # stale backlog is spread over the hour, no per-invoice state is kept and
+    # a full reload of the index does not reset anyone's schedule.
+    __slots__ = ("stale_after", "stale_interval", "window")
+
+    def __init__(self, stale_after: float, stale_interval: float, window: float):
+        self.stale_after = stale_after
+        self.stale_interval = stale_interval
+        self.window = window
+
+    def due(self, key: bytes, created: float, now: float) -> bool:
+        if self.stale_after <= 0 or now - created < self.stale_after or self.stale_interval <= self.window:
+            return True
+        phase = int.from_bytes(key[4:8], "big") / 2 ** 32 * self.stale_interval
+        return (now + phase) % self.stale_interval < self.window
+
+class AddressGroup:
+    __slots__ = ("ids", "amounts", "created")
+
+    def __init__(self):
+        self.ids = bytearray()
+        self.amounts = array("d")
+        self.created = array("d")
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def find(self, key: bytes) -> int:
+        start = 0
+        while True:
+            pos = self.ids.find(key, start)
+            if pos < 0:
+                return -1
+            if pos % ID_BYTES == 0:
+                return pos // ID_BYTES
+            start = pos + 1
+
+    def add(self, key: bytes, amount: float, created: float, check_duplicates: bool = True) -> bool:
+        # The duplicate check scans the group, so bulk loads from one cursor
+        # (which cannot repeat an id) skip it to stay linear
+        if check_duplicates and self.find(key) >= 0:
+            return False
+        self.ids += key
+        self.amounts.append(amount)
+        self.created.append(created)
+        return True
+
+    def remove(self, key: bytes) -> bool:
+        index = self.find(key)
+        if index < 0:
+            return False
+        # Swap with the last entry so removal stays O(1) after the lookup
+        last = len(self) - 1
+        self.ids[index * ID_BYTES:(index + 1) * ID_BYTES] = self.ids[last * ID_BYTES:]
+        del self.ids[last * ID_BYTES:]
+        self.amounts[index] = self.amounts[last]
+        self.amounts.pop()
+        self.created[index] = self.created[last]
+        self.created.pop()
+        return True
+
+    def entries(self, shard: Optional[int] = None, shards: int = 1,
+                schedule: Optional[RecheckSchedule] = None, now: float = 0.0):
+        for index in range(len(self)):
+            key = bytes(self.ids[index * ID_BYTES:(index + 1) * ID_BYTES])
+            # The first hex digit of the id picks the sweep shard
+            if shard is not None and (key[0] >> 4) % shards != shard:
+                continue
+            if schedule is not None and not schedule.due(key, self.created[index], now):
+                continue
+            yield str(uuid.UUID(bytes=key)), self.amounts[index]
+
+class PendingIndex:
+    def __init__(self):
+        self.groups = {}
+        self.count = 0
+        self.watermark = ""
+        self.reconciled_at = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.reconciled_at is not None
+
+    def needs_reconcile(self, max_age_seconds: float) -> bool:
+        return not self.loaded or time.monotonic() - self.reconciled_at >= max_age_seconds
+
+    def add(self, invoice: dict, check_duplicates: bool = True) -> bool:
+        if invoice.get('status', "pending") != "pending":
+            return False
+        key = id_key(invoice['id'])
+        group_id = group_key(invoice)
+        if key is None or group_id is None:
+            return False
+        group = self.groups.get(group_id)
+        if group is None:
+            group = self.groups[group_id] = AddressGroup()
+        added = group.add(key, float(invoice['amount']), created_time(invoice.get('created_at')), check_duplicates)
+        if added:
+            self.count += 1
+        created_at = invoice.get('created_at')
+        if isinstance(created_at, str) and created_at > self.watermark:
+            self.watermark = created_at
+        return added
+
+    def created_since(self, overlap_seconds: float) -> str:
+        # created_at is stamped before the insert commits, and local adds move
+        # the watermark too, so an invoice stamped just before it can still
+        # show up later; re-read that stretch and let add() drop repeats
+        if not self.watermark:
+            return ""
+        return (datetime.fromisoformat(self.watermark) - timedelta(seconds=overlap_seconds)).isoformat()
+
+    def remove(self, group_id: Optional[tuple], invoice_id: str) -> bool:
+        group = self.groups.get(group_id)
+        key = id_key(invoice_id)
+        if group is None or key is None or not group.remove(key):
+            return False
+        self.count -= 1
+        if not len(group):
+            del self.groups[group_id]
+        return True
+
+    def discard(self, invoice: dict) -> bool:
+        return self.remove(group_key(invoice), invoice['id'])
+
+    def replace_with(self, other: "PendingIndex"):
+        self.groups = other.groups
+        self.count = other.count
+        self.watermark = other.watermark
+        self.reconciled_at = time.monotonic()
+
+    def snapshot(self, shard: Optional[int] = None, shards: int = 1,
+                 schedule: Optional[RecheckSchedule] = None) -> list:
+        # Materialized so the sweep can await while events keep mutating the index
+        now = time.time()
+        snapshot = []
+        for group_id, group in list(self.groups.items()):
+            entries = list(group.entries(shard, shards, schedule, now))
+            if entries:
+                snapshot.append((group_id, entries))
+        return snapshot
@@ -0,0 +1,143 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+try:
+    from pyinstrument import Profiler as StackProfiler
+except ImportError:
+    StackProfiler = None
+
+# Opt-in request profiling. A request is kept when it is slower than
+# PROFILE_SLOW_MS or carries the debug header; "X-Debug-Profile: stack"
+# additionally captures a call stack (pyinstrument if installed, else cProfile).
+# The header is honoured only for callers the app allows (admins), since a
+# stack capture slows every request on the loop and forced samples would push
+# real slow requests out of the buffer.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "500"))
+PROFILE_BUFFER_SIZE = int(os.environ.get("PROFILE_BUFFER_SIZE", "200"))
+PROFILE_HEADER = "x-debug-profile"
+
+current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+profiles = deque(maxlen=PROFILE_BUFFER_SIZE)
+# Only one stack profiler can be attached to the interpreter at a time
+stack_lock = threading.Lock()
+
+class RequestProfile:
+    __slots__ = ("started", "spans")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add_span(self, name: str, started: float, duration: float):
+        self.spans.append((name, started - self.started, duration))
+
+@contextmanager
+def span(name: str):
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, started, time.perf_counter() - started)
+
+def record_span(name: str, started: float, duration: float):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add_span(name, started, duration)
+
+class StackCapture:
+    def __init__(self):
+        self.profiler = None
+        self.acquired = stack_lock.acquire(blocking=False)
+        if not self.acquired:
+            return
+        if StackProfiler is not None:
+            self.profiler = StackProfiler(async_mode="enabled")
+            self.profiler.start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def finish(self) -> Optional[str]:
+        if not self.acquired:
+            return None
+        try:
+            if StackProfiler is not None:
+                self.profiler.stop()
+                return self.profiler.output_text(unicode=False, color=False)
+            self.profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(40)
+            return out.getvalue()
+        finally:
+            stack_lock.release()
+
+class RequestProfiler:
+    def __init__(self, allow_debug: Callable):
+        self.allow_debug = allow_debug
+
+    async def __call__(self, request, call_next):
+        if not PROFILING_ENABLED:
+            return await call_next(request)
+
+        header = request.headers.get(PROFILE_HEADER, "")
+        if header and not self.allow_debug(request):
+            header = ""
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        stack = StackCapture() if header == "stack" else None
+        try:
+            response = await call_next(request)
+        finally:
+            current_profile.reset(token)
+            stack_text = stack.finish() if stack else None
+
+        duration_ms = (time.perf_counter() - profile.started) * 1000
+        if header or duration_ms >= PROFILE_SLOW_MS:
+            route = request.scope.get("route")
+            totals = {}
+            for name, _, duration in profile.spans:
+                totals[name] = totals.get(name, 0.0) + duration * 1000
+            profiles.append({
+                "id": str(uuid.uuid4()),
+                "method": request.method,
+                "path": request.url.path,
+                "route": route.path if route is not None else None,
+                "status": response.status_code,
+                "reason": "header" if header else "slow",
+                "started_at": datetime.now(timezone.utc).isoformat(),
+                "duration_ms": round(duration_ms, 3),
+                "span_totals_ms": {name: round(ms, 3) for name, ms in totals.items()},
+                "spans": [
+                    {"name": name, "offset_ms": round(offset * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                    for name, offset, duration in profile.spans
+                ],
+                "stack": stack_text
+            })
+        return response
+
+def list_profiles() -> list:
+    return [
+        {key: value for key, value in profile.items() if key not in ("spans", "stack")}
+        for profile in reversed(profiles)
+    ]
+
+def get_profile(profile_id: str) -> Optional[dict]:
+    for profile in profiles:
+        if profile["id"] == profile_id:
+            return profile
+    return None
@@ -0,0 +1,177 @@
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from profiling import record_span
+
+# Per-request accounting of MongoDB round trips. The Motor database is wrapped
+# so every collection call is timed and attributed to the request in flight.
+# Endpoints declare how many round trips they may make with @query_budget(n);
+# going over (or repeating one query shape QUERY_REPEAT_THRESHOLD times, the
+# usual sign of an N+1 loop) is logged, and with QUERY_BUDGET_STRICT=true the
+# request fails so tests and benchmarks catch the regression. Queries a
+# streamed response body runs after the handler has returned (exports) are
+# timed but not counted: the budget is checked before the body is sent.
+QUERY_TRACING = os.environ.get("QUERY_TRACING", "true").lower() == "true"
+QUERY_BUDGET_STRICT = os.environ.get("QUERY_BUDGET_STRICT", "false").lower() == "true"
+QUERY_REPEAT_THRESHOLD = int(os.environ.get("QUERY_REPEAT_THRESHOLD", "3"))
+
+current_trace: ContextVar[Optional["QueryTrace"]] = ContextVar("current_trace", default=None)
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+class QueryTrace:
+    __slots__ = ("count", "seconds", "shapes")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, shape: str, started: float, duration: float):
+        self.count += 1
+        self.seconds += duration
+        self.shapes[shape] += 1
+
+def query_budget(max_queries: int):
+    def decorator(endpoint):
+        endpoint.query_budget = max_queries
+        return endpoint
+    return decorator
+
+def query_shape(value) -> str:
+    # Keeps field names and operators, drops values: {"id": "abc"} -> {id:?}
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{key}:{query_shape(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + (query_shape(value[0]) if value else "") + "]"
+    return "?"
+
+def record_query(collection: str, operation: str, filter_or_pipeline, started: float):
+    duration = time.perf_counter() - started
+    record_span(f"mongo.{collection}.{operation}", started, duration)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.record(f"{collection}.{operation}{query_shape(filter_or_pipeline)}", started, duration)
+
+class InstrumentedCursor:
+    def __init__(self, cursor, collection: str, operation: str, query):
+        self._cursor = cursor
+        self._collection = collection
+        self._operation = operation
+        self._query = query
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in ("sort", "limit", "skip", "batch_size", "max_time_ms", "hint"):
+            def chained(*args, **kwargs):
+                attr(*args, **kwargs)
+                return self
+            return chained
+        return attr
+
+    async def to_list(self, length=None):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.to_list(length)
+        finally:
+            record_query(self._collection, self._operation, self._query, started)
+
+    async def __aiter__(self):
+        # Counted once, timed to the first batch; later getMores are streaming
+        started = time.perf_counter()
+        recorded = False
+        try:
+            async for document in self._cursor:
+                if not recorded:
+                    record_query(self._collection, self._operation, self._query, started)
+                    recorded = True
+                yield document
+        finally:
+            if not recorded:
+                record_query(self._collection, self._operation, self._query, started)
+
+class InstrumentedCollection:
+    TIMED = {
+        "find_one", "insert_one", "insert_many", "update_one", "update_many",
+        "replace_one", "delete_one", "delete_many", "count_documents",
+        "find_one_and_update", "find_one_and_delete", "bulk_write", "distinct",
+    }
+    CURSORS = {"find", "aggregate"}
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._name = collection.name
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in self.TIMED:
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await attr(*args, **kwargs)
+                finally:
+                    record_query(self._name, name, args[0] if args else kwargs.get("filter"), started)
+            return timed
+        if name in self.CURSORS:
+            def cursor(*args, **kwargs):
+                query = args[0] if args else kwargs.get("filter", kwargs.get("pipeline"))
+                return InstrumentedCursor(attr(*args, **kwargs), self._name, name, query)
+            return cursor
+        return attr
+
+    def with_options(self, **kwargs) -> "InstrumentedCollection":
+        return InstrumentedCollection(self._collection.with_options(**kwargs))
+
+class InstrumentedDatabase:
+    def __init__(self, database):
+        self._database = database
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = InstrumentedCollection(self._database[name])
+        return collection
+
+    def with_options(self, **kwargs) -> "InstrumentedDatabase":
+        return InstrumentedDatabase(self._database.with_options(**kwargs))
+
+async def enforce_query_budget(request, call_next):
+    if not QUERY_TRACING:
+        return await call_next(request)
+
+    trace = QueryTrace()
+    token = current_trace.set(trace)
+    try:
+        response = await call_next(request)
+    finally:
+        current_trace.reset(token)
+
+    response.headers["X-DB-Queries"] = str(trace.count)
+    response.headers["X-DB-Time-Ms"] = f"{trace.seconds * 1000:.3f}"
+
+    problems = []
+    endpoint = request.scope.get("endpoint")
+    budget = getattr(endpoint, "query_budget", None)
+    if budget is not None and trace.count > budget:
+        problems.append(f"{trace.count} queries (budget {budget})")
+    repeated = [shape for shape, seen in trace.shapes.items() if seen >= QUERY_REPEAT_THRESHOLD]
+    if repeated:
+        problems.append(f"repeated query shapes {repeated}")
+
+    if problems:
+        message = f"{request.method} {request.url.path}: " + "; ".join(problems)
+        if QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logging.warning(f"Query budget exceeded - {message}")
+    return response
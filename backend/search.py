@@ -0,0 +1,45 @@
+import re
+from typing import Optional
+
+# Prefix search over invoices, clients and staff. Searchable text is
+# normalized at write time into a lowercase `search_terms` array (words plus
+# whole email addresses) covered by a multikey index, so a typeahead query is
+# a set of anchored regexes that MongoDB answers from index bounds instead of
+# scanning documents. Every query word must prefix-match one of the terms.
+MAX_TERMS = 64
+MAX_QUERY_WORDS = 6
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+def search_terms(*values: Optional[str]) -> list:
+    terms = []
+    for value in values:
+        if not value:
+            continue
+        value = value.lower()
+        if "@" in value:
+            terms.append(value)
+        terms.extend(WORD_PATTERN.findall(value))
+    # dict keeps first-seen order while dropping duplicates
+    return list(dict.fromkeys(terms))[:MAX_TERMS]
+
+def invoice_search_terms(invoice: dict) -> list:
+    return search_terms(invoice.get('description'))
+
+def user_search_terms(user: dict) -> list:
+    return search_terms(user.get('full_name'), user.get('email'))
+
+def staff_search_terms(staff: dict) -> list:
+    return search_terms(staff.get('name'), staff.get('email'))
+
+def query_words(q: str) -> list:
+    q = q.strip().lower()
+    words = WORD_PATTERN.findall(q)
+    if "@" in q:
+        words = [q]
+    return words[:MAX_QUERY_WORDS]
+
+def prefix_filter(q: str) -> Optional[dict]:
+    words = query_words(q)
+    if not words:
+        return None
+    return {"search_terms": {"$all": [re.compile("^" + re.escape(word)) for word in words]}}
@@ -1,8 +1,10 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
@@ -11,35 +13,123 @@ from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
-from jose import JWTError, jwt
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-from fastapi.responses import StreamingResponse
+from jose import JWTError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import io
-from web3 import Web3
-import httpx
+import csv
+import json
+import re
 import asyncio
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import time
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from metrics import (
+    BCRYPT_POOL_WAIT,
+    CHAIN_CHECK_DURATION,
+    HTTP_REQUEST_DURATION,
+    PAYMENT_SWEEP_BACKLOG,
+    PAYMENT_SWEEP_DURATION,
+    MongoCommandMetrics,
+    MongoPoolMetrics,
+    render_metrics,
+)
+from profiling import RequestProfiler, get_profile, list_profiles, record_span, span
+from query_budget import InstrumentedDatabase, enforce_query_budget, query_budget
+from invoice_state import mark_invoice_paid
+from pending_index import MULTI_CURRENCY, PendingIndex, RecheckSchedule
+from mongo_settings import analytics_read_preference, cache_write_concern, client_options, durable_write_concern
+from price_oracle import PriceOracle, feed_from_env
+from admission import AdmissionController, MemoryBuckets, MongoBuckets, Rule
+from auth_tokens import RevocationList, SigningKeys, TokenVerifier
+from search import invoice_search_terms, prefix_filter, staff_search_terms, user_search_terms
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = AsyncIOMotorClient(
+    mongo_url,
+    event_listeners=[MongoCommandMetrics(), MongoPoolMetrics()],
+    **client_options()
+)
+db = InstrumentedDatabase(client[os.environ['DB_NAME']])
+
+def configure_database_views():
+    # Views over db that differ only in read preference or write concern
+    global analytics_db, durable_db, cache_db
+    analytics_db = db.with_options(read_preference=analytics_read_preference())
+    durable_db = db.with_options(write_concern=durable_write_concern())
+    cache_db = db.with_options(write_concern=cache_write_concern())
+
+configure_database_views()
 
 app = FastAPI(title="Crypto Payment System")
 api_router = APIRouter(prefix="/api")
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt is deliberately slow; run it on a bounded pool instead of the event loop
+BCRYPT_POOL_SIZE = int(os.environ.get("BCRYPT_POOL_SIZE", "4"))
+bcrypt_pool = ThreadPoolExecutor(max_workers=BCRYPT_POOL_SIZE, thread_name_prefix="bcrypt")
 SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-change-in-production")
-ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
+REVOCATION_SYNC_SECONDS = float(os.environ.get("REVOCATION_SYNC_SECONDS", "5"))
+REVOCATION_RELOAD_SECONDS = float(os.environ.get("REVOCATION_RELOAD_SECONDS", "3600"))
+signing_keys = SigningKeys.from_env(SECRET_KEY)
+revocations = RevocationList()
+token_verifier = TokenVerifier(signing_keys, revocations)
 
 security = HTTPBearer()
 
-scheduler = AsyncIOScheduler()
+# web3, reportlab, httpx and apscheduler are imported on first use. With
+# API_ONLY=true the process never needs them: chain checks and receipt
+# rendering are queued for the background worker instead.
+API_ONLY = os.environ.get("API_ONLY", "false").lower() == "true"
+
+scheduler = None
+
+# Identifies this process when claiming scheduler job leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+PAYMENT_SWEEP_INTERVAL_SECONDS = 120
+AUTO_INVOICE_INTERVAL_SECONDS = 24 * 60 * 60
+# Pending invoices are split by the first hex digit of their id, so at most 16 shards
+SWEEP_SHARDS = max(1, min(16, int(os.environ.get("SWEEP_SHARDS", "1"))))
+
+# Only populated in processes that run the payment sweep
+pending_index = PendingIndex()
+
+PRICE_REFRESH_SECONDS = float(os.environ.get("PRICE_REFRESH_SECONDS", "60"))
+PRICE_MAX_AGE_SECONDS = float(os.environ.get("PRICE_MAX_AGE_SECONDS", "600"))
+price_oracle = PriceOracle(feed_from_env(), PRICE_MAX_AGE_SECONDS)
+
+SSE_KEEPALIVE_SECONDS = int(os.environ.get("SSE_KEEPALIVE_SECONDS", "15"))
+
+class InvoiceEventBus:
+    # In-process fan-out of invoice status transitions to SSE subscribers.
+    # When a Mongo change stream is running it becomes the single source of
+    # events (it also sees writes made by other workers), so local publishes
+    # are skipped to avoid delivering the same transition twice.
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self.subscribers = set()
+        self.change_stream_active = False
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_queue)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event: dict):
+        for queue in list(self.subscribers):
+            if queue.full():
+                # Slow consumer: drop its oldest event rather than block the publisher
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+invoice_events = InvoiceEventBus()
+change_stream_task = None
 
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -101,6 +191,7 @@ class Invoice(BaseModel):
     payment_address: Optional[str] = None
     payment_addresses: Optional[dict] = None
     tx_hash: Optional[str] = None
+    paid_currency: Optional[str] = None
     tip_amount: Optional[float] = 0.0
     tip_paid: Optional[bool] = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -122,6 +213,10 @@ class Payment(BaseModel):
     tx_hash: str
     amount: str
     currency: str
+    chain: Optional[str] = None
+    address: Optional[str] = None
+    block_height: Optional[int] = None
+    required_confirmations: int = 1
     status: str = "pending"
     confirmations: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -133,57 +228,126 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def run_in_bcrypt_pool(fn, *args):
+    submitted = time.perf_counter()
+    
+    def timed():
+        waited = time.perf_counter() - submitted
+        BCRYPT_POOL_WAIT.observe(waited)
+        return waited, fn(*args)
+    
+    with span("bcrypt"):
+        waited, result = await asyncio.get_running_loop().run_in_executor(bcrypt_pool, timed)
+    record_span("bcrypt.wait", submitted, waited)
+    return result
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    to_encode.update({"exp": expire, "jti": str(uuid.uuid4())})
+    return signing_keys.encode(to_encode)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def user_claims(user: User) -> dict:
+    # Identity travels in the token so requests can be authorized without a
+    # user lookup; role changes apply on the next login or after revocation
+    return {
+        "sub": user.email,
+        "role": user.role,
+        "uid": user.id,
+        "name": user.full_name,
+        "created_at": user.created_at.isoformat()
+    }
+
+def staff_user(staff: dict) -> User:
+    if isinstance(staff['created_at'], str):
+        staff['created_at'] = datetime.fromisoformat(staff['created_at'])
+    return User(
+        id=staff['id'],
+        email=staff['email'],
+        full_name=staff['name'],
+        role='staff',
+        created_at=staff['created_at']
+    )
+
+def verify_token(credentials: HTTPAuthorizationCredentials) -> dict:
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        role: str = payload.get("role")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        # Check if it's a staff member first
-        if role == "staff":
-            staff = await db.staff.find_one({"email": email}, {"_id": 0, "password": 0})
-            if staff is None:
-                raise HTTPException(status_code=401, detail="Staff not found")
-            
-            if isinstance(staff['created_at'], str):
-                staff['created_at'] = datetime.fromisoformat(staff['created_at'])
-            
-            # Convert staff to User format
-            user_data = User(
-                id=staff['id'],
-                email=staff['email'],
-                full_name=staff['name'],
-                role='staff',
-                created_at=staff['created_at']
-            )
-            return user_data
-        else:
-            # Regular user lookup
-            user = await db.users.find_one({"email": email}, {"_id": 0, "password": 0})
-            if user is None:
-                raise HTTPException(status_code=401, detail="User not found")
-            
-            if isinstance(user['created_at'], str):
-                user['created_at'] = datetime.fromisoformat(user['created_at'])
-            
-            return User(**user)
+        return token_verifier.verify(credentials.credentials)
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = verify_token(credentials)
+    email: str = payload.get("sub")
+    role: str = payload.get("role")
+    if email is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    if "uid" in payload:
+        return User(
+            id=payload['uid'],
+            email=email,
+            full_name=payload['name'],
+            role=role,
+            created_at=datetime.fromisoformat(payload['created_at'])
+        )
+    
+    # Tokens issued before identity claims were embedded still need a lookup
+    if role == "staff":
+        staff = await db.staff.find_one({"email": email}, {"_id": 0, "password": 0})
+        if staff is None:
+            raise HTTPException(status_code=401, detail="Staff not found")
+        return staff_user(staff)
+    
+    user = await db.users.find_one({"email": email}, {"_id": 0, "password": 0})
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    if isinstance(user['created_at'], str):
+        user['created_at'] = datetime.fromisoformat(user['created_at'])
+    
+    return User(**user)
+
+async def follow_revocations(stop: asyncio.Event):
+    last_reload = 0.0
+    while not stop.is_set():
+        try:
+            full = time.monotonic() - last_reload >= REVOCATION_RELOAD_SECONDS
+            await revocations.sync(db.revoked_tokens, full=full)
+            if full:
+                last_reload = time.monotonic()
+        except Exception as e:
+            logging.error(f"Error syncing revoked tokens: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=REVOCATION_SYNC_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+def invoice_event(invoice: dict) -> dict:
+    return {
+        "invoice_id": invoice.get('id'),
+        "status": invoice.get('status'),
+        "tx_hash": invoice.get('tx_hash'),
+        "paid_at": invoice.get('paid_at'),
+        "staff_id": invoice.get('staff_id'),
+        "client_id": invoice.get('client_id')
+    }
+
+def publish_invoice_event(invoice: dict):
+    if not invoice_events.change_stream_active:
+        invoice_events.publish(invoice_event(invoice))
+
+def can_view_invoice_event(user: User, event: dict) -> bool:
+    if user.role == "client":
+        return event.get('client_id') == user.id
+    if user.role == "staff":
+        return event.get('staff_id') == user.id
+    return True
+
 @api_router.post("/auth/register", response_model=Token)
+@query_budget(2)
 async def register(user_data: UserCreate):
     existing = await db.users.find_one({"email": user_data.email})
     if existing:
@@ -191,25 +355,27 @@ async def register(user_data: UserCreate):
     
     user_dict = user_data.model_dump()
     password = user_dict.pop("password")
-    hashed = hash_password(password)
+    hashed = await run_in_bcrypt_pool(hash_password, password)
     
     user_obj = User(**user_dict)
     doc = user_obj.model_dump()
     doc['password'] = hashed
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['search_terms'] = user_search_terms(doc)
     
     await db.users.insert_one(doc)
     
-    access_token = create_access_token(data={"sub": user_obj.email})
+    access_token = create_access_token(data=user_claims(user_obj))
     return Token(access_token=access_token, token_type="bearer", user=user_obj)
 
 @api_router.post("/auth/login", response_model=Token)
+@query_budget(1)
 async def login(credentials: UserLogin):
     user_doc = await db.users.find_one({"email": credentials.email})
     if not user_doc:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if not verify_password(credentials.password, user_doc['password']):
+    if not await run_in_bcrypt_pool(verify_password, credentials.password, user_doc['password']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     user_doc.pop('password')
@@ -219,45 +385,57 @@ async def login(credentials: UserLogin):
         user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
     
     user = User(**user_doc)
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data=user_claims(user))
     return Token(access_token=access_token, token_type="bearer", user=user)
 
 @api_router.post("/auth/staff/login", response_model=Token)
+@query_budget(1)
 async def staff_login(credentials: UserLogin):
     staff_doc = await db.staff.find_one({"email": credentials.email})
     if not staff_doc:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if not verify_password(credentials.password, staff_doc['password']):
+    if not await run_in_bcrypt_pool(verify_password, credentials.password, staff_doc['password']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     staff_doc.pop('password')
     staff_doc.pop('_id')
     
-    if isinstance(staff_doc['created_at'], str):
-        staff_doc['created_at'] = datetime.fromisoformat(staff_doc['created_at'])
+    user_data = staff_user(staff_doc)
+    access_token = create_access_token(data=user_claims(user_data))
+    return Token(access_token=access_token, token_type="bearer", user=user_data)
+
+@api_router.post("/auth/logout")
+@query_budget(1)
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = verify_token(credentials)
+    if "jti" not in payload:
+        raise HTTPException(status_code=400, detail="Token cannot be revoked")
     
-    user_data = User(
-        id=staff_doc['id'],
-        email=staff_doc['email'],
-        full_name=staff_doc['name'],
-        role='staff',
-        created_at=staff_doc['created_at']
+    # Kept until the token would have expired anyway, then dropped by the TTL index
+    await durable_db.revoked_tokens.update_one(
+        {"_id": payload['jti']},
+        {"$setOnInsert": {
+            "revoked_at": datetime.now(timezone.utc),
+            "expires_at": datetime.fromtimestamp(payload['exp'], timezone.utc)
+        }},
+        upsert=True
     )
-    
-    access_token = create_access_token(data={"sub": user_data.email, "role": "staff"})
-    return Token(access_token=access_token, token_type="bearer", user=user_data)
+    revocations.add(payload['jti'])
+    return {"detail": "Logged out"}
 
 @api_router.get("/auth/me", response_model=User)
+@query_budget(0)
 async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 @api_router.get("/clients")
+@query_budget(1)
 async def list_clients(current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    clients = await db.users.find({"role": "client"}, {"_id": 0, "password": 0}).to_list(1000)
+    clients = await analytics_db.users.find({"role": "client"}, {"_id": 0, "password": 0, "search_terms": 0}).to_list(1000)
     
     for client in clients:
         if isinstance(client['created_at'], str):
@@ -266,6 +444,7 @@ async def list_clients(current_user: User = Depends(get_current_user)):
     return clients
 
 @api_router.post("/staff", response_model=Staff)
+@query_budget(2)
 async def create_staff(staff_data: StaffCreate, current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -276,19 +455,21 @@ async def create_staff(staff_data: StaffCreate, current_user: User = Depends(get
     
     staff_dict = staff_data.model_dump()
     password = staff_dict.pop("password")
-    hashed_password = hash_password(password)
+    hashed_password = await run_in_bcrypt_pool(hash_password, password)
     
     staff_obj = Staff(**staff_dict)
     doc = staff_obj.model_dump()
     doc['password'] = hashed_password
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['search_terms'] = staff_search_terms(doc)
     
     await db.staff.insert_one(doc)
     return staff_obj
 
 @api_router.get("/staff", response_model=List[Staff])
+@query_budget(1)
 async def list_staff(current_user: User = Depends(get_current_user)):
-    staff_list = await db.staff.find({"active": True}, {"_id": 0}).to_list(1000)
+    staff_list = await analytics_db.staff.find({"active": True}, {"_id": 0}).to_list(1000)
     
     for staff in staff_list:
         if isinstance(staff['created_at'], str):
@@ -297,6 +478,7 @@ async def list_staff(current_user: User = Depends(get_current_user)):
     return staff_list
 
 @api_router.get("/staff/{staff_id}", response_model=Staff)
+@query_budget(1)
 async def get_staff(staff_id: str, current_user: User = Depends(get_current_user)):
     staff = await db.staff.find_one({"id": staff_id, "active": True}, {"_id": 0})
     if not staff:
@@ -308,31 +490,35 @@ async def get_staff(staff_id: str, current_user: User = Depends(get_current_user
     return Staff(**staff)
 
 @api_router.put("/staff/{staff_id}", response_model=Staff)
+@query_budget(1)
 async def update_staff(staff_id: str, staff_data: StaffCreate, current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
     update_dict = staff_data.model_dump()
     if 'password' in update_dict and update_dict['password']:
-        update_dict['password'] = hash_password(update_dict['password'])
+        update_dict['password'] = await run_in_bcrypt_pool(hash_password, update_dict['password'])
     else:
         update_dict.pop('password', None)
+    update_dict['search_terms'] = staff_search_terms(update_dict)
     
-    result = await db.staff.update_one(
+    updated = await db.staff.find_one_and_update(
         {"id": staff_id},
-        {"$set": update_dict}
+        {"$set": update_dict},
+        projection={"_id": 0, "password": 0},
+        return_document=ReturnDocument.AFTER
     )
     
-    if result.matched_count == 0:
+    if not updated:
         raise HTTPException(status_code=404, detail="Staff not found")
     
-    updated = await db.staff.find_one({"id": staff_id}, {"_id": 0, "password": 0})
     if isinstance(updated['created_at'], str):
         updated['created_at'] = datetime.fromisoformat(updated['created_at'])
     
     return Staff(**updated)
 
 @api_router.post("/invoices", response_model=Invoice)
+@query_budget(3)
 async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -372,8 +558,11 @@ async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depen
     )
     doc = invoice_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['search_terms'] = invoice_search_terms(doc)
     
     await db.invoices.insert_one(doc)
+    if pending_index.loaded:
+        pending_index.add(doc)
     
     if invoice_data.auto_generate:
         await db.auto_invoices.insert_one({
@@ -390,7 +579,8 @@ async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depen
     return invoice_obj
 
 @api_router.get("/invoices", response_model=List[Invoice])
-async def list_invoices(current_user: User = Depends(get_current_user), status: Optional[str] = None):
+@query_budget(1)
+async def list_invoices(current_user: User = Depends(get_current_user), status: Optional[str] = None, archived: bool = False):
     query = {}
     
     if current_user.role == "client":
@@ -401,7 +591,8 @@ async def list_invoices(current_user: User = Depends(get_current_user), status:
     if status:
         query["status"] = status
     
-    invoices = await db.invoices.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    collection = analytics_db.invoices_archive if archived else analytics_db.invoices
+    invoices = await collection.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
     
     for invoice in invoices:
         if isinstance(invoice['created_at'], str):
@@ -411,14 +602,23 @@ async def list_invoices(current_user: User = Depends(get_current_user), status:
     
     return invoices
 
+async def find_invoice(query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+    # Old paid invoices live in invoices_archive; look there only on a miss
+    projection = projection or {"_id": 0}
+    invoice = await db.invoices.find_one(query, projection)
+    if invoice is None:
+        invoice = await db.invoices_archive.find_one(query, projection)
+    return invoice
+
 @api_router.get("/invoices/{invoice_id}", response_model=Invoice)
+@query_budget(2)
 async def get_invoice(invoice_id: str, current_user: User = Depends(get_current_user)):
     query = {"id": invoice_id}
     
     if current_user.role == "client":
         query["client_id"] = current_user.id
     
-    invoice = await db.invoices.find_one(query, {"_id": 0})
+    invoice = await find_invoice(query)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
@@ -429,103 +629,423 @@ async def get_invoice(invoice_id: str, current_user: User = Depends(get_current_
     
     return Invoice(**invoice)
 
+CHECK_PAYMENT_MIN_INTERVAL_SECONDS = float(os.environ.get("CHECK_PAYMENT_MIN_INTERVAL_SECONDS", "30"))
+CHECK_PAYMENT_CACHE_SIZE = 10000
+
+# invoice_id -> monotonic time of the last manual check that found no payment
+recent_payment_checks = {}
+
+def remember_payment_check(invoice_id: str):
+    now = time.monotonic()
+    if len(recent_payment_checks) >= CHECK_PAYMENT_CACHE_SIZE:
+        cutoff = now - CHECK_PAYMENT_MIN_INTERVAL_SECONDS
+        for key in [k for k, checked_at in recent_payment_checks.items() if checked_at < cutoff]:
+            del recent_payment_checks[key]
+    recent_payment_checks[invoice_id] = now
+
+async def settle_invoice(invoice_id: str, payment_detected: dict) -> Optional[dict]:
+    # Returns the paid invoice only to the caller that won the pending -> paid transition
+    paid = await mark_invoice_paid(durable_db.invoices, invoice_id, payment_detected.get('tx_hash'), payment_detected.get('settlement'))
+    if paid:
+        pending_index.discard(paid)
+        publish_invoice_event(paid)
+        await record_payment(paid, payment_detected)
+        await enqueue_job("render_receipt", {"invoice_id": invoice_id})
+    return paid
+
+async def record_payment(invoice: dict, payment_detected: dict):
+    currency = payment_detected.get('currency', invoice['currency'])
+    chain = CHAINS.get(currency)
+    amount = invoice['amount']
+    settlement = payment_detected.get('settlement') or {}
+    if settlement.get('usd_price'):
+        amount = amount / settlement['usd_price']
+    
+    payment = Payment(
+        invoice_id=invoice['id'],
+        tx_hash=payment_detected.get('tx_hash') or "",
+        amount=str(amount),
+        currency=currency,
+        chain=chain,
+        address=payment_detected.get('address'),
+        block_height=payment_detected.get('block_height'),
+        required_confirmations=REQUIRED_CONFIRMATIONS.get(chain, 1)
+    )
+    doc = payment.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    doc['next_check_at'] = datetime.now(timezone.utc)
+    await durable_db.payments.insert_one(doc)
+
+@api_router.get("/invoices/{invoice_id}/payment", response_model=Payment)
+@query_budget(3)
+async def get_invoice_payment(invoice_id: str, current_user: User = Depends(get_current_user)):
+    query = {"id": invoice_id}
+    
+    if current_user.role == "client":
+        query["client_id"] = current_user.id
+    elif current_user.role == "staff":
+        query["staff_id"] = current_user.id
+    
+    invoice = await find_invoice(query, {"_id": 0, "id": 1})
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    
+    payment = await db.payments.find_one({"invoice_id": invoice_id}, {"_id": 0, "next_check_at": 0})
+    if not payment:
+        raise HTTPException(status_code=404, detail="No payment recorded")
+    
+    if isinstance(payment['created_at'], str):
+        payment['created_at'] = datetime.fromisoformat(payment['created_at'])
+    if payment.get('confirmed_at') and isinstance(payment['confirmed_at'], str):
+        payment['confirmed_at'] = datetime.fromisoformat(payment['confirmed_at'])
+    
+    return Payment(**payment)
+
 @api_router.post("/invoices/{invoice_id}/check-payment")
+@query_budget(4)
 async def check_payment(invoice_id: str, current_user: User = Depends(get_current_user)):
-    invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
+    invoice = await find_invoice({"id": invoice_id})
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
     if invoice['status'] == "paid":
         return {"status": "paid", "message": "Invoice already paid"}
     
-    address = invoice['payment_address']
-    currency = invoice['currency']
-    amount = invoice['amount']
+    last_checked = recent_payment_checks.get(invoice_id)
+    if last_checked is not None and time.monotonic() - last_checked < CHECK_PAYMENT_MIN_INTERVAL_SECONDS:
+        return {"status": "pending", "message": "No payment detected yet", "cached": True}
     
-    payment_detected = await check_blockchain_payment(address, currency, amount)
+    if API_ONLY:
+        # The worker runs the check; the settlement reaches the invoice's event stream
+        # through the change stream, or its keepalive poll on a standalone mongod
+        await enqueue_job("check_payment", {"invoice_id": invoice_id})
+        remember_payment_check(invoice_id)
+        return {"status": "pending", "message": "Payment check queued"}
+    
+    payment_detected = await detect_invoice_payment(invoice)
     
     if payment_detected:
-        await db.invoices.update_one(
-            {"id": invoice_id},
-            {"$set": {
-                "status": "paid",
-                "paid_at": datetime.now(timezone.utc).isoformat(),
-                "tx_hash": payment_detected.get('tx_hash')
-            }}
-        )
-        return {"status": "paid", "message": "Payment detected", "tx_hash": payment_detected.get('tx_hash')}
+        recent_payment_checks.pop(invoice_id, None)
+        paid = await settle_invoice(invoice_id, payment_detected)
+        if not paid:
+            # A concurrent check or the sweep settled it first
+            return {"status": "paid", "message": "Invoice already paid"}
+        return {"status": "paid", "message": "Payment detected", "tx_hash": paid['tx_hash']}
     
+    remember_payment_check(invoice_id)
     return {"status": "pending", "message": "No payment detected yet"}
 
-async def check_blockchain_payment(address: str, currency: str, expected_amount: float):
+def format_sse(event: dict) -> str:
+    return f"event: invoice.status\ndata: {json.dumps(event, default=str)}\n\n"
+
+SSE_POLL_OVERLAP_SECONDS = 60
+
+async def poll_paid_invoice_events(current_user: User, invoice_id: Optional[str], since: str, delivered) -> list:
+    query = {"status": "paid"}
+    if invoice_id:
+        query["id"] = invoice_id
+    else:
+        query["paid_at"] = {"$gt": since}
+        if delivered:
+            query["id"] = {"$nin": list(delivered)}
+        if current_user.role == "client":
+            query["client_id"] = current_user.id
+        elif current_user.role == "staff":
+            query["staff_id"] = current_user.id
+    
+    invoices = await db.invoices.find(query, {"_id": 0}).sort("paid_at", 1).to_list(100)
+    return [invoice_event(invoice) for invoice in invoices]
+
+async def invoice_event_stream(current_user: User, invoice_id: Optional[str] = None):
+    queue = invoice_events.subscribe()
+    started = datetime.now(timezone.utc)
+    polled_at = started
+    next_poll_at = time.monotonic() + SSE_KEEPALIVE_SECONDS
+    # invoice id -> paid_at of settlements already sent; an id can only come
+    # back while its paid_at is inside the poll window, so older ones are dropped
+    delivered = {}
+    
+    def is_new(event: dict) -> bool:
+        if invoice and event['invoice_id'] != invoice['id']:
+            return False
+        if not can_view_invoice_event(current_user, event):
+            return False
+        return event['status'] != "paid" or event['invoice_id'] not in delivered
+    
+    def mark_delivered(event: dict):
+        if event['status'] == "paid":
+            delivered[event['invoice_id']] = str(event.get('paid_at') or datetime.now(timezone.utc).isoformat())
+    
     try:
-        if currency == "LTC":
-            blockcypher_token = os.environ.get("BLOCKCYPHER_TOKEN", "9cfa7f7aa1ea4338b6263e529378f804")
-            url = f"https://api.blockcypher.com/v1/ltc/main/addrs/{address}/balance?token={blockcypher_token}"
+        invoice = None
+        if invoice_id:
+            # Read (and send) the current state only after subscribing, so a
+            # transition that lands before the client connected is not missed
+            invoice = await find_invoice({"id": invoice_id})
+            if invoice is None:
+                return
+            yield format_sse(invoice_event(invoice))
+            if invoice['status'] == "paid":
+                return
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=max(0, next_poll_at - time.monotonic()))
+            except asyncio.TimeoutError:
+                event = None
+            if event is not None and is_new(event):
+                mark_delivered(event)
+                yield format_sse(event)
+                if invoice and event['status'] == "paid":
+                    return
+            if time.monotonic() < next_poll_at:
+                continue
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url)
-                if response.status_code == 200:
-                    data = response.json()
-                    balance_ltc = data.get('balance', 0) / 100000000
-                    
-                    if balance_ltc >= expected_amount:
-                        tx_url = f"https://api.blockcypher.com/v1/ltc/main/addrs/{address}/full?token={blockcypher_token}"
-                        tx_response = await client.get(tx_url)
-                        if tx_response.status_code == 200:
-                            tx_data = tx_response.json()
-                            if tx_data.get('txs'):
-                                latest_tx = tx_data['txs'][0]
-                                return {"detected": True, "tx_hash": latest_tx.get('hash', 'ltc_payment')}
+            # Runs on a deadline rather than when the bus goes quiet, so a busy
+            # process still polls and still sends keepalives
+            next_poll_at = time.monotonic() + SSE_KEEPALIVE_SECONDS
+            if not invoice_events.change_stream_active:
+                # Without a change stream, settlements made by other processes
+                # (the worker or the sweep lease holder) never reach this bus;
+                # poll for them instead. Each window starts before the previous
+                # poll to absorb clock skew, and delivered ids are not sent twice.
+                since = max(started, polled_at - timedelta(seconds=SSE_POLL_OVERLAP_SECONDS)).isoformat()
+                polled_at = datetime.now(timezone.utc)
+                for event in await poll_paid_invoice_events(current_user, invoice_id, since, delivered):
+                    if not is_new(event):
+                        continue
+                    mark_delivered(event)
+                    yield format_sse(event)
+                    if invoice:
+                        return
+                window_start = max(started, polled_at - timedelta(seconds=SSE_POLL_OVERLAP_SECONDS)).isoformat()
+                delivered = {paid_id: paid_at for paid_id, paid_at in delivered.items() if paid_at > window_start}
+            yield ": keepalive\n\n"
+    finally:
+        invoice_events.unsubscribe(queue)
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@api_router.get("/invoices/{invoice_id}/events")
+@query_budget(2)
+async def stream_invoice_events(invoice_id: str, current_user: User = Depends(get_current_user)):
+    query = {"id": invoice_id}
+    
+    if current_user.role == "client":
+        query["client_id"] = current_user.id
+    elif current_user.role == "staff":
+        query["staff_id"] = current_user.id
+    
+    invoice = await find_invoice(query, {"_id": 0, "id": 1})
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    
+    return StreamingResponse(
+        invoice_event_stream(current_user, invoice_id),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+@api_router.get("/events/invoices")
+@query_budget(0)
+async def stream_all_invoice_events(current_user: User = Depends(get_current_user)):
+    return StreamingResponse(
+        invoice_event_stream(current_user),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+ERC20_CONTRACTS = {
+    "USDT": "0xdAC17F958D2ee523a2206206994597C13D831ec7",
+    "USDC": "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+}
+
+ERC20_BALANCE_ABI = [
+    {
+        "constant": True,
+        "inputs": [{"name": "_owner", "type": "address"}],
+        "name": "balanceOf",
+        "outputs": [{"name": "balance", "type": "uint256"}],
+        "type": "function"
+    }
+]
+
+CHAIN_PROVIDERS = {"LTC": "blockcypher", "USDT": "infura", "USDC": "infura"}
+CHAINS = {"LTC": "litecoin", "USDT": "ethereum", "USDC": "ethereum"}
+REQUIRED_CONFIRMATIONS = {"litecoin": 6, "ethereum": 12}
+BLOCK_SECONDS = {"litecoin": 150, "ethereum": 12}
+
+inflight_chain_requests = {}
+
+async def single_flight(key: tuple, factory):
+    # Concurrent callers asking for the same key share one in-flight provider call
+    task = inflight_chain_requests.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        inflight_chain_requests[key] = task
+        task.add_done_callback(lambda _: inflight_chain_requests.pop(key, None))
+    return await asyncio.shield(task)
+
+def ethereum_web3(infura_key: str):
+    from web3 import Web3
+    
+    return Web3(Web3.HTTPProvider(f"https://mainnet.infura.io/v3/{infura_key}"))
+
+async def fetch_address_balance(address: str, currency: str) -> Optional[float]:
+    if currency == "LTC":
+        blockcypher_token = os.environ.get("BLOCKCYPHER_TOKEN", "9cfa7f7aa1ea4338b6263e529378f804")
+        url = f"https://api.blockcypher.com/v1/ltc/main/addrs/{address}/balance?token={blockcypher_token}"
         
-        elif currency in ["USDT", "USDC"]:
-            infura_key = os.environ.get("INFURA_API_KEY", "")
-            if not infura_key:
-                logging.warning("INFURA_API_KEY not set, skipping ERC20 check")
-                return None
-            
-            w3 = Web3(Web3.HTTPProvider(f"https://mainnet.infura.io/v3/{infura_key}"))
-            
-            if currency == "USDT":
-                contract_address = "0xdAC17F958D2ee523a2206206994597C13D831ec7"
-            else:
-                contract_address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
-            
-            contract_abi = [
-                {
-                    "constant": True,
-                    "inputs": [{"name": "_owner", "type": "address"}],
-                    "name": "balanceOf",
-                    "outputs": [{"name": "balance", "type": "uint256"}],
-                    "type": "function"
-                }
-            ]
-            
-            contract = w3.eth.contract(address=contract_address, abi=contract_abi)
-            balance = contract.functions.balanceOf(address).call()
-            balance_tokens = balance / (10 ** 6)
-            
-            if balance_tokens >= expected_amount:
-                return {"detected": True, "tx_hash": f"{currency}_payment_detected"}
+        import httpx
+        
+        async with httpx.AsyncClient() as client:
+            response = await client.get(url)
+            if response.status_code == 200:
+                data = response.json()
+                return data.get('balance', 0) / 100000000
+        return None
+    
+    elif currency in ERC20_CONTRACTS:
+        infura_key = os.environ.get("INFURA_API_KEY", "")
+        if not infura_key:
+            logging.warning("INFURA_API_KEY not set, skipping ERC20 check")
+            return None
+        
+        w3 = ethereum_web3(infura_key)
+        contract = w3.eth.contract(address=ERC20_CONTRACTS[currency], abi=ERC20_BALANCE_ABI)
+        balance = await asyncio.to_thread(contract.functions.balanceOf(address).call)
+        return balance / (10 ** 6)
+    
+    return None
+
+async def fetch_latest_tx(address: str, currency: str) -> Optional[dict]:
+    if currency == "LTC":
+        blockcypher_token = os.environ.get("BLOCKCYPHER_TOKEN", "9cfa7f7aa1ea4338b6263e529378f804")
+        tx_url = f"https://api.blockcypher.com/v1/ltc/main/addrs/{address}/full?token={blockcypher_token}"
+        
+        import httpx
+        
+        async with httpx.AsyncClient() as client:
+            tx_response = await client.get(tx_url)
+            if tx_response.status_code == 200:
+                tx_data = tx_response.json()
+                if tx_data.get('txs'):
+                    latest_tx = tx_data['txs'][0]
+                    # block_height is -1 while the transaction is unconfirmed
+                    block_height = latest_tx.get('block_height', -1)
+                    return {
+                        "tx_hash": latest_tx.get('hash', 'ltc_payment'),
+                        "block_height": block_height if block_height >= 0 else None
+                    }
+        return None
+    
+    # The balance check does not identify a transaction; the block it was
+    # observed at stands in for confirmation counting
+    return {"tx_hash": f"{currency}_payment_detected", "block_height": await fetch_chain_height(CHAINS[currency])}
+
+async def fetch_chain_height(chain: str) -> Optional[int]:
+    if chain == "litecoin":
+        blockcypher_token = os.environ.get("BLOCKCYPHER_TOKEN", "9cfa7f7aa1ea4338b6263e529378f804")
+        
+        import httpx
+        
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"https://api.blockcypher.com/v1/ltc/main?token={blockcypher_token}")
+            if response.status_code == 200:
+                return response.json().get('height')
+        return None
+    
+    if chain == "ethereum":
+        infura_key = os.environ.get("INFURA_API_KEY", "")
+        if not infura_key:
+            return None
+        w3 = ethereum_web3(infura_key)
+        return await asyncio.to_thread(lambda: w3.eth.block_number)
+    
+    return None
+
+async def fetch_tx_block_height(tx_hash: str, chain: str) -> Optional[int]:
+    if chain != "litecoin":
+        return None
+    
+    blockcypher_token = os.environ.get("BLOCKCYPHER_TOKEN", "9cfa7f7aa1ea4338b6263e529378f804")
+    
+    import httpx
+    
+    async with httpx.AsyncClient() as client:
+        response = await client.get(f"https://api.blockcypher.com/v1/ltc/main/txs/{tx_hash}?token={blockcypher_token}")
+        if response.status_code == 200:
+            block_height = response.json().get('block_height', -1)
+            return block_height if block_height >= 0 else None
+    return None
+
+async def timed_chain_call(call: str, currency: str, coro):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await coro
+        outcome = "ok" if result is not None else "empty"
+        return result
+    finally:
+        elapsed = time.perf_counter() - started
+        CHAIN_CHECK_DURATION.labels(
+            CHAIN_PROVIDERS.get(currency, "unknown"), currency, call, outcome
+        ).observe(elapsed)
+        record_span(f"chain.{call}", started, elapsed)
+
+async def check_blockchain_payment(address: str, currency: str, expected_amount: float):
+    try:
+        balance = await single_flight(
+            ("balance", currency, address),
+            lambda: timed_chain_call("balance", currency, fetch_address_balance(address, currency))
+        )
+        if balance is None or balance < expected_amount:
+            return None
+        
+        latest_tx = await single_flight(
+            ("tx", currency, address),
+            lambda: timed_chain_call("latest_tx", currency, fetch_latest_tx(address, currency))
+        )
+        if latest_tx:
+            return {
+                "detected": True,
+                "tx_hash": latest_tx['tx_hash'],
+                "block_height": latest_tx.get('block_height'),
+                "currency": currency,
+                "address": address
+            }
         
         return None
     except Exception as e:
         logging.error(f"Error checking blockchain: {e}")
         return None
 
-@api_router.get("/invoices/{invoice_id}/receipt")
-async def download_receipt(invoice_id: str, current_user: User = Depends(get_current_user)):
-    query = {"id": invoice_id, "status": "paid"}
+async def detect_multi_currency_payment(addresses: dict, amount_usd: float):
+    # CRYPTO invoices are quoted in USD and payable to any listed address;
+    # every address is checked concurrently against the converted amount
+    async def check(currency: str, address: str):
+        price = price_oracle.price(currency)
+        if not price:
+            return None
+        payment = await check_blockchain_payment(address, currency, amount_usd / price)
+        if payment:
+            payment['settlement'] = {"paid_currency": currency, "payment_address": address, "usd_price": price}
+        return payment
     
-    if current_user.role == "client":
-        query["client_id"] = current_user.id
+    results = await asyncio.gather(*[check(currency, address) for currency, address in addresses.items()])
+    return next((result for result in results if result), None)
+
+async def detect_invoice_payment(invoice: dict):
+    if invoice['currency'] == MULTI_CURRENCY:
+        return await detect_multi_currency_payment(invoice.get('payment_addresses') or {}, invoice['amount'])
+    return await check_blockchain_payment(invoice['payment_address'], invoice['currency'], invoice['amount'])
+
+def render_receipt_pdf(invoice: dict, staff: Optional[dict], client: Optional[dict]) -> bytes:
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.pdfgen import canvas
     
-    invoice = await db.invoices.find_one(query, {"_id": 0})
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found or not paid")
-    
-    staff = await db.staff.find_one({"id": invoice['staff_id']}, {"_id": 0})
-    client = await db.users.find_one({"id": invoice['client_id']}, {"_id": 0})
+    staff = staff or {}
+    client = client or {}
     
     buffer = io.BytesIO()
     p = canvas.Canvas(buffer, pagesize=letter)
@@ -561,21 +1081,224 @@ async def download_receipt(invoice_id: str, current_user: User = Depends(get_cur
     p.showPage()
     p.save()
     
-    buffer.seek(0)
+    return buffer.getvalue()
+
+async def build_receipt(invoice: dict) -> bytes:
+    staff = await db.staff.find_one({"id": invoice['staff_id']}, {"_id": 0})
+    client = await db.users.find_one({"id": invoice['client_id']}, {"_id": 0})
+    
+    # reportlab is CPU bound, keep it off the event loop
+    with span("reportlab"):
+        pdf = await asyncio.to_thread(render_receipt_pdf, invoice, staff, client)
+    await cache_db.receipts.update_one(
+        {"invoice_id": invoice['id']},
+        {"$set": {"invoice_id": invoice['id'], "pdf": pdf, "created_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    return pdf
+
+@api_router.get("/invoices/{invoice_id}/receipt")
+@query_budget(6)
+async def download_receipt(invoice_id: str, current_user: User = Depends(get_current_user)):
+    query = {"id": invoice_id, "status": "paid"}
+    
+    if current_user.role == "client":
+        query["client_id"] = current_user.id
+    
+    invoice = await find_invoice(query)
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found or not paid")
+    
+    # Receipts are pre-rendered by the background worker when the invoice is paid;
+    # render on demand only if that has not happened yet
+    receipt = await db.receipts.find_one({"invoice_id": invoice_id}, {"_id": 0, "pdf": 1})
+    if receipt:
+        pdf = receipt['pdf']
+    elif API_ONLY:
+        await enqueue_job("render_receipt", {"invoice_id": invoice_id})
+        return JSONResponse(
+            status_code=202,
+            content={"detail": "Receipt is being generated"},
+            headers={"Retry-After": "2"}
+        )
+    else:
+        pdf = await build_receipt(invoice)
+    
     return StreamingResponse(
-        buffer,
+        io.BytesIO(pdf),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename=receipt_{invoice_id}.pdf"}
     )
 
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "500"))
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+INVOICE_EXPORT_FIELDS = [
+    "id", "staff_id", "client_id", "amount", "currency", "description", "status",
+    "payment_address", "tx_hash", "paid_currency", "created_at", "paid_at"
+]
+CLIENT_EXPORT_FIELDS = ["id", "email", "full_name", "created_at"]
+
+def as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def export_cursors_response(cursors: list, fields: list, export_format: str, filename: str):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported export format")
+    
+    async def rows():
+        # One row at a time from cursors with server-side batches, so memory
+        # stays flat however many documents match
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            yield buffer.getvalue()
+        for cursor in cursors:
+            async for document in cursor:
+                if export_format == "csv":
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerow(document)
+                    yield buffer.getvalue()
+                else:
+                    yield json.dumps({field: document.get(field) for field in fields}, default=str) + "\n"
+    
+    return StreamingResponse(
+        rows(),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{export_format}"}
+    )
+
+# The export cursors run while the body streams, after the budget is checked
+@api_router.get("/export/invoices")
+@query_budget(0)
+async def export_invoices(
+    current_user: User = Depends(get_current_user),
+    format: str = "csv",
+    status: Optional[str] = None,
+    staff_id: Optional[str] = None,
+    currency: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    include_archived: bool = False
+):
+    query = {}
+    
+    if current_user.role == "client":
+        query["client_id"] = current_user.id
+    elif current_user.role == "staff":
+        query["staff_id"] = current_user.id
+    elif staff_id:
+        query["staff_id"] = staff_id
+    
+    if status:
+        query["status"] = status
+    if currency:
+        query["currency"] = currency
+    if created_from or created_to:
+        # created_at is stored as an ISO string, which sorts chronologically
+        query["created_at"] = {}
+        if created_from:
+            query["created_at"]["$gte"] = as_utc(created_from).isoformat()
+        if created_to:
+            query["created_at"]["$lt"] = as_utc(created_to).isoformat()
+    
+    projection = {"_id": 0, **{field: 1 for field in INVOICE_EXPORT_FIELDS}}
+    collections = [analytics_db.invoices, analytics_db.invoices_archive] if include_archived else [analytics_db.invoices]
+    cursors = [
+        collection.find(query, projection).sort("created_at", 1).batch_size(EXPORT_BATCH_SIZE)
+        for collection in collections
+    ]
+    return export_cursors_response(cursors, INVOICE_EXPORT_FIELDS, format, "invoices")
+
+# As above, the cursor is not counted
+@api_router.get("/export/clients")
+@query_budget(0)
+async def export_clients(current_user: User = Depends(get_current_user), format: str = "csv"):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    projection = {"_id": 0, **{field: 1 for field in CLIENT_EXPORT_FIELDS}}
+    cursor = analytics_db.users.find({"role": "client"}, projection).sort("created_at", 1).batch_size(EXPORT_BATCH_SIZE)
+    return export_cursors_response([cursor], CLIENT_EXPORT_FIELDS, format, "clients")
+
+SEARCH_LIMIT = 50
+TX_HASH_MIN_PREFIX = 6
+
+@api_router.get("/search")
+@query_budget(3)
+async def search(q: str, current_user: User = Depends(get_current_user), limit: int = 10):
+    limit = max(1, min(limit, SEARCH_LIMIT))
+    terms_query = prefix_filter(q)
+    results = {"invoices": [], "clients": [], "staff": []}
+    if terms_query is None:
+        return results
+    
+    invoice_query = terms_query
+    q = q.strip()
+    if len(q) >= TX_HASH_MIN_PREFIX and " " not in q:
+        invoice_query = {"$or": [terms_query, {"tx_hash": {"$regex": "^" + re.escape(q)}}]}
+    if current_user.role == "client":
+        invoice_query = {"$and": [invoice_query, {"client_id": current_user.id}]}
+    elif current_user.role == "staff":
+        invoice_query = {"$and": [invoice_query, {"staff_id": current_user.id}]}
+    
+    results["invoices"] = await analytics_db.invoices.find(invoice_query, {
+        "_id": 0, "id": 1, "description": 1, "amount": 1, "currency": 1, "status": 1, "tx_hash": 1, "created_at": 1
+    }).limit(limit).to_list(limit)
+    
+    if current_user.role == "admin":
+        results["clients"] = await analytics_db.users.find(
+            {**terms_query, "role": "client"}, {"_id": 0, "id": 1, "email": 1, "full_name": 1}
+        ).limit(limit).to_list(limit)
+        results["staff"] = await analytics_db.staff.find(
+            {**terms_query, "active": True}, {"_id": 0, "id": 1, "email": 1, "name": 1}
+        ).limit(limit).to_list(limit)
+    
+    return results
+
+@api_router.get("/admin/profiles")
+@query_budget(0)
+async def list_request_profiles(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return list_profiles()
+
+@api_router.get("/admin/profiles/{profile_id}")
+@query_budget(0)
+async def get_request_profile(profile_id: str, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    profile = get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    return profile
+
+def usd_value(amount: float, currency: str) -> Optional[float]:
+    # CRYPTO invoices are quoted in USD already
+    if currency == MULTI_CURRENCY:
+        return amount
+    return price_oracle.to_usd(amount, currency)
+
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
+@query_budget(6)
+async def get_dashboard_stats(current_user: User = Depends(get_current_user), include_archived: bool = False):
     if current_user.role == "admin":
-        total_invoices = await db.invoices.count_documents({})
-        pending_invoices = await db.invoices.count_documents({"status": "pending"})
-        paid_invoices = await db.invoices.count_documents({"status": "paid"})
-        total_staff = await db.staff.count_documents({"active": True})
-        total_clients = await db.users.count_documents({"role": "client"})
+        total_invoices = await analytics_db.invoices.count_documents({})
+        pending_invoices = await analytics_db.invoices.count_documents({"status": "pending"})
+        paid_invoices = await analytics_db.invoices.count_documents({"status": "paid"})
+        total_staff = await analytics_db.staff.count_documents({"active": True})
+        total_clients = await analytics_db.users.count_documents({"role": "client"})
+        
+        if include_archived:
+            archived = await analytics_db.invoices_archive.count_documents({})
+            total_invoices += archived
+            paid_invoices += archived
         
         return {
             "total_invoices": total_invoices,
@@ -585,26 +1308,40 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
             "total_clients": total_clients
         }
     elif current_user.role == "staff":
-        total_invoices = await db.invoices.count_documents({"staff_id": current_user.id})
-        pending = await db.invoices.count_documents({"staff_id": current_user.id, "status": "pending"})
-        paid = await db.invoices.count_documents({"staff_id": current_user.id, "status": "paid"})
+        total_invoices = await analytics_db.invoices.count_documents({"staff_id": current_user.id})
+        pending = await analytics_db.invoices.count_documents({"staff_id": current_user.id, "status": "pending"})
+        paid = await analytics_db.invoices.count_documents({"staff_id": current_user.id, "status": "paid"})
         
-        pipeline = [
-            {"$match": {"staff_id": current_user.id, "status": "paid"}},
-            {"$group": {"_id": "$currency", "total": {"$sum": "$amount"}}}
-        ]
-        earnings = await db.invoices.aggregate(pipeline).to_list(100)
+        pipeline = [{"$match": {"staff_id": current_user.id, "status": "paid"}}]
+        if include_archived:
+            archived = await analytics_db.invoices_archive.count_documents({"staff_id": current_user.id})
+            total_invoices += archived
+            paid += archived
+            pipeline.append({"$unionWith": {
+                "coll": "invoices_archive",
+                "pipeline": [{"$match": {"staff_id": current_user.id}}]
+            }})
+        pipeline.append({"$group": {"_id": "$currency", "total": {"$sum": "$amount"}}})
+        earnings = await analytics_db.invoices.aggregate(pipeline).to_list(100)
+        usd_values = [usd_value(entry['total'], entry['_id']) for entry in earnings]
         
         return {
             "total_invoices": total_invoices,
             "pending_invoices": pending,
             "paid_invoices": paid,
-            "earnings": earnings
+            "earnings": earnings,
+            # None while any needed price is unavailable or stale
+            "earnings_usd": None if None in usd_values else round(sum(usd_values), 2)
         }
     else:
-        total_invoices = await db.invoices.count_documents({"client_id": current_user.id})
-        pending = await db.invoices.count_documents({"client_id": current_user.id, "status": "pending"})
-        paid = await db.invoices.count_documents({"client_id": current_user.id, "status": "paid"})
+        total_invoices = await analytics_db.invoices.count_documents({"client_id": current_user.id})
+        pending = await analytics_db.invoices.count_documents({"client_id": current_user.id, "status": "pending"})
+        paid = await analytics_db.invoices.count_documents({"client_id": current_user.id, "status": "paid"})
+        
+        if include_archived:
+            archived = await analytics_db.invoices_archive.count_documents({"client_id": current_user.id})
+            total_invoices += archived
+            paid += archived
         
         return {
             "total_invoices": total_invoices,
@@ -612,29 +1349,149 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
             "paid_invoices": paid
         }
 
-async def check_pending_payments():
+PENDING_INDEX_RECONCILE_SECONDS = float(os.environ.get("PENDING_INDEX_RECONCILE_SECONDS", "900"))
+PENDING_INDEX_OVERLAP_SECONDS = float(os.environ.get("PENDING_INDEX_OVERLAP_SECONDS", "60"))
+# Invoices still unpaid after SWEEP_STALE_AFTER_DAYS (0 disables) drop from every
+# sweep to one check per SWEEP_STALE_INTERVAL_SECONDS; check-payment still works
+SWEEP_STALE_AFTER_DAYS = float(os.environ.get("SWEEP_STALE_AFTER_DAYS", "3"))
+SWEEP_STALE_INTERVAL_SECONDS = float(os.environ.get("SWEEP_STALE_INTERVAL_SECONDS", "3600"))
+sweep_schedule = RecheckSchedule(SWEEP_STALE_AFTER_DAYS * 86400, SWEEP_STALE_INTERVAL_SECONDS, PAYMENT_SWEEP_INTERVAL_SECONDS)
+SWEEP_CONCURRENCY = int(os.environ.get("SWEEP_CONCURRENCY", "8"))
+PENDING_INDEX_FIELDS = {
+    "_id": 0, "id": 1, "currency": 1, "payment_address": 1, "payment_addresses": 1, "amount": 1, "created_at": 1
+}
+
+async def refresh_pending_index():
+    # Full reload every PENDING_INDEX_RECONCILE_SECONDS drops invoices settled by
+    # other processes; in between only invoices created since shortly before
+    # the watermark are read
+    if pending_index.needs_reconcile(PENDING_INDEX_RECONCILE_SECONDS):
+        fresh = PendingIndex()
+        async for invoice in db.invoices.find({"status": "pending"}, PENDING_INDEX_FIELDS).batch_size(5000):
+            fresh.add(invoice, check_duplicates=False)
+        pending_index.replace_with(fresh)
+    else:
+        query = {"status": "pending", "created_at": {"$gte": pending_index.created_since(PENDING_INDEX_OVERLAP_SECONDS)}}
+        async for invoice in db.invoices.find(query, PENDING_INDEX_FIELDS):
+            pending_index.add(invoice)
+
+async def sweep_group(semaphore: asyncio.Semaphore, group_id: tuple, entries: list):
+    currency, target = group_id
+    async with semaphore:
+        # Checked concurrently so single-flight turns them into one provider call per address
+        if currency == MULTI_CURRENCY:
+            results = await asyncio.gather(*[
+                detect_multi_currency_payment(dict(target), amount) for _, amount in entries
+            ])
+        else:
+            results = await asyncio.gather(*[
+                check_blockchain_payment(target, currency, amount) for _, amount in entries
+            ])
+    
+    for (invoice_id, _), payment_detected in zip(entries, results):
+        if not payment_detected:
+            continue
+        if await settle_invoice(invoice_id, payment_detected):
+            logging.info(f"Payment detected for invoice {invoice_id}")
+        else:
+            # Already settled elsewhere; the index was stale
+            pending_index.remove(group_id, invoice_id)
+
+async def check_pending_payments(shard: Optional[int] = None):
+    started = time.perf_counter()
     try:
-        pending = await db.invoices.find({"status": "pending"}, {"_id": 0}).to_list(100)
+        await refresh_pending_index()
+        groups = pending_index.snapshot(shard, SWEEP_SHARDS, sweep_schedule)
+        PAYMENT_SWEEP_BACKLOG.set(sum(len(entries) for _, entries in groups))
         
-        for invoice in pending:
-            address = invoice['payment_address']
-            currency = invoice['currency']
-            amount = invoice['amount']
-            
-            payment_detected = await check_blockchain_payment(address, currency, amount)
-            
-            if payment_detected:
-                await db.invoices.update_one(
-                    {"id": invoice['id']},
-                    {"$set": {
-                        "status": "paid",
-                        "paid_at": datetime.now(timezone.utc).isoformat(),
-                        "tx_hash": payment_detected.get('tx_hash')
-                    }}
-                )
-                logging.info(f"Payment detected for invoice {invoice['id']}")
+        semaphore = asyncio.Semaphore(SWEEP_CONCURRENCY)
+        await asyncio.gather(*[
+            sweep_group(semaphore, group_id, entries) for group_id, entries in groups
+        ])
     except Exception as e:
         logging.error(f"Error checking pending payments: {e}")
+    finally:
+        PAYMENT_SWEEP_DURATION.observe(time.perf_counter() - started)
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_INTERVAL_SECONDS = 6 * 60 * 60
+
+async def archive_paid_invoices() -> int:
+    # Copy first, then delete: a crash in between leaves duplicates that the
+    # unique id index on the archive absorbs on the next run
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    archived = 0
+    while True:
+        batch = await db.invoices.find(
+            {"status": "paid", "paid_at": {"$lt": cutoff}}, {"_id": 0}
+        ).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        
+        # Must be durable before the originals are deleted below
+        await durable_db.invoices_archive.bulk_write(
+            [UpdateOne({"id": invoice['id']}, {"$setOnInsert": invoice}, upsert=True) for invoice in batch],
+            ordered=False
+        )
+        await db.invoices.delete_many({"id": {"$in": [invoice['id'] for invoice in batch]}, "status": "paid"})
+        archived += len(batch)
+    
+    if archived:
+        logging.info(f"Archived {archived} paid invoices older than {ARCHIVE_AFTER_DAYS} days")
+    return archived
+
+CONFIRMATION_CHECK_SECONDS = 30
+PAYMENT_STALE_SECONDS = 24 * 60 * 60
+
+async def confirmation_update(payment: dict, chain_height: Optional[int], now: datetime) -> dict:
+    chain = payment.get('chain')
+    update = {}
+    
+    block_height = payment.get('block_height')
+    if block_height is None and payment.get('tx_hash'):
+        # Only needed until the transaction is mined; afterwards the chain height is enough
+        try:
+            block_height = await fetch_tx_block_height(payment['tx_hash'], chain)
+        except Exception as e:
+            logging.error(f"Error fetching block height for {payment['tx_hash']}: {e}")
+        if block_height is not None:
+            update['block_height'] = block_height
+    
+    confirmations = payment.get('confirmations', 0)
+    if chain_height is not None and block_height is not None:
+        confirmations = max(0, chain_height - block_height + 1)
+    update['confirmations'] = confirmations
+    
+    remaining = payment.get('required_confirmations', 1) - confirmations
+    if remaining <= 0:
+        update['status'] = "confirmed"
+        update['confirmed_at'] = now.isoformat()
+    elif (now - datetime.fromisoformat(payment['created_at'])).total_seconds() > PAYMENT_STALE_SECONDS:
+        update['status'] = "stale"
+    else:
+        # Due again about when the next confirmations should have landed
+        update['next_check_at'] = now + timedelta(seconds=BLOCK_SECONDS.get(chain, 60) * min(remaining, 3))
+    return update
+
+async def track_confirmations():
+    now = datetime.now(timezone.utc)
+    due = await db.payments.find(
+        {"status": "pending", "next_check_at": {"$lte": now}}, {"_id": 0}
+    ).to_list(1000)
+    if not due:
+        return
+    
+    # One height lookup per chain, however many payments are waiting on it
+    chains = sorted({payment['chain'] for payment in due if payment.get('chain')})
+    results = await asyncio.gather(*[fetch_chain_height(chain) for chain in chains], return_exceptions=True)
+    heights = {chain: height for chain, height in zip(chains, results) if isinstance(height, int)}
+    
+    updates = []
+    for payment in due:
+        update = await confirmation_update(payment, heights.get(payment.get('chain')), now)
+        updates.append(UpdateOne({"id": payment['id']}, {"$set": update}))
+    await durable_db.payments.bulk_write(updates, ordered=False)
 
 async def generate_auto_invoices():
     try:
@@ -687,7 +1544,10 @@ async def generate_auto_invoices():
                 
                 doc = new_invoice.model_dump()
                 doc['created_at'] = doc['created_at'].isoformat()
+                doc['search_terms'] = invoice_search_terms(doc)
                 await db.invoices.insert_one(doc)
+                if pending_index.loaded:
+                    pending_index.add(doc)
                 
                 await db.auto_invoices.update_one(
                     {"staff_id": auto_invoice['staff_id'], "client_id": auto_invoice['client_id']},
@@ -699,8 +1559,336 @@ async def generate_auto_invoices():
     except Exception as e:
         logging.error(f"Error generating auto invoices: {e}")
 
+async def acquire_job_lease(name: str, ttl_seconds: float) -> bool:
+    # A lease is held by one worker until it expires; the holder renews it on
+    # every run so the job keeps running in the same process while it is alive
+    now = datetime.now(timezone.utc)
+    try:
+        await db.job_leases.find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lte": now}}, {"owner": WORKER_ID}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def release_job_leases():
+    await db.job_leases.delete_many({"owner": WORKER_ID})
+    await db.worker_heartbeats.delete_one({"_id": WORKER_ID})
+
+async def assigned_sweep_shards() -> List[int]:
+    now = datetime.now(timezone.utc)
+    await db.worker_heartbeats.update_one(
+        {"_id": WORKER_ID},
+        {"$set": {"expires_at": now + timedelta(seconds=PAYMENT_SWEEP_INTERVAL_SECONDS * 1.5)}},
+        upsert=True
+    )
+    live = await db.worker_heartbeats.find({"expires_at": {"$gt": now}}, {"_id": 1}).to_list(1000)
+    workers = sorted(doc["_id"] for doc in live)
+    rank = workers.index(WORKER_ID)
+    return [shard for shard in range(SWEEP_SHARDS) if shard % len(workers) == rank]
+
+async def run_payment_sweep():
+    lease_ttl = PAYMENT_SWEEP_INTERVAL_SECONDS * 1.5
+    try:
+        if SWEEP_SHARDS == 1:
+            if await acquire_job_lease("check_pending_payments", lease_ttl):
+                await check_pending_payments()
+            return
+        
+        # Shards are spread across live workers; the per-shard lease keeps a
+        # shard from being swept twice while worker membership changes
+        for shard in await assigned_sweep_shards():
+            if await acquire_job_lease(f"check_pending_payments:{shard}", lease_ttl):
+                await check_pending_payments(shard)
+    except Exception as e:
+        logging.error(f"Error running payment sweep: {e}")
+
+async def run_price_refresh():
+    # One worker fetches and persists prices; the others follow price_history
+    try:
+        if await acquire_job_lease("refresh_prices", PRICE_REFRESH_SECONDS * 1.5):
+            await price_oracle.refresh(db.price_history)
+        else:
+            await price_oracle.load_latest(db.price_history)
+    except Exception as e:
+        logging.error(f"Error refreshing prices: {e}")
+
+async def follow_price_history(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            await price_oracle.load_latest(db.price_history)
+        except Exception as e:
+            logging.error(f"Error loading prices: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=PRICE_REFRESH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+SEARCH_BACKFILL_BATCH_SIZE = 1000
+SEARCH_BACKFILL_INTERVAL_SECONDS = 60 * 60
+
+async def backfill_search_terms():
+    # Documents written before search existed get their terms here; new writes
+    # set them inline
+    for collection, fields, terms in (
+        (cache_db.invoices, {"_id": 0, "id": 1, "description": 1}, invoice_search_terms),
+        (cache_db.users, {"_id": 0, "id": 1, "full_name": 1, "email": 1}, user_search_terms),
+        (cache_db.staff, {"_id": 0, "id": 1, "name": 1, "email": 1}, staff_search_terms),
+    ):
+        while True:
+            batch = await collection.find({"search_terms": {"$exists": False}}, fields).limit(
+                SEARCH_BACKFILL_BATCH_SIZE
+            ).to_list(SEARCH_BACKFILL_BATCH_SIZE)
+            if not batch:
+                break
+            await collection.bulk_write(
+                [UpdateOne({"id": doc['id']}, {"$set": {"search_terms": terms(doc)}}) for doc in batch],
+                ordered=False
+            )
+
+async def run_search_backfill():
+    try:
+        if await acquire_job_lease("backfill_search_terms", SEARCH_BACKFILL_INTERVAL_SECONDS):
+            await backfill_search_terms()
+    except Exception as e:
+        logging.error(f"Error backfilling search terms: {e}")
+
+async def run_invoice_archival():
+    try:
+        if ARCHIVE_AFTER_DAYS > 0 and await acquire_job_lease("archive_paid_invoices", ARCHIVE_INTERVAL_SECONDS * 1.5):
+            await archive_paid_invoices()
+    except Exception as e:
+        logging.error(f"Error archiving invoices: {e}")
+
+async def run_confirmation_tracking():
+    try:
+        if await acquire_job_lease("track_confirmations", CONFIRMATION_CHECK_SECONDS * 1.5):
+            await track_confirmations()
+    except Exception as e:
+        logging.error(f"Error tracking confirmations: {e}")
+
+async def run_auto_invoice_generation():
+    try:
+        if await acquire_job_lease("generate_auto_invoices", AUTO_INVOICE_INTERVAL_SECONDS * 1.5):
+            await generate_auto_invoices()
+    except Exception as e:
+        logging.error(f"Error running auto-invoice generation: {e}")
+
+JOB_LOCK_SECONDS = 300
+JOB_MAX_ATTEMPTS = 5
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "2"))
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", "2"))
+JOB_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+async def enqueue_job(kind: str, payload: dict, delay_seconds: float = 0):
+    now = datetime.now(timezone.utc)
+    job_id = str(uuid.uuid4())
+    await db.jobs.insert_one({
+        "id": job_id,
+        "kind": kind,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "run_after": now + timedelta(seconds=delay_seconds),
+        "created_at": now
+    })
+    return job_id
+
+async def ensure_job_indexes():
+    await db.jobs.create_index([("status", 1), ("run_after", 1)])
+    await db.jobs.create_index("finished_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
+    await db.price_history.create_index("fetched_at")
+    await db.payments.create_index([("status", 1), ("next_check_at", 1)])
+    await db.payments.create_index("invoice_id")
+    await db.invoices.create_index([("status", 1), ("paid_at", 1)])
+    await db.invoices_archive.create_index("id", unique=True)
+    await db.invoices_archive.create_index([("client_id", 1), ("created_at", -1)])
+    await db.invoices_archive.create_index([("staff_id", 1), ("created_at", -1)])
+    await db.invoices.create_index("search_terms")
+    await db.invoices.create_index("tx_hash", sparse=True)
+    await db.users.create_index("search_terms")
+    await db.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.revoked_tokens.create_index("revoked_at")
+    await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+    await db.staff.create_index("search_terms")
+
+async def render_receipt_job(invoice_id: str):
+    invoice = await db.invoices.find_one({"id": invoice_id, "status": "paid"}, {"_id": 0})
+    if invoice:
+        await build_receipt(invoice)
+
+async def check_payment_job(invoice_id: str):
+    invoice = await db.invoices.find_one({"id": invoice_id, "status": "pending"}, {"_id": 0})
+    if not invoice:
+        return
+    payment_detected = await detect_invoice_payment(invoice)
+    if payment_detected:
+        await settle_invoice(invoice_id, payment_detected)
+
+JOB_HANDLERS = {
+    "render_receipt": render_receipt_job,
+    "check_payment": check_payment_job,
+}
+
+async def claim_next_job():
+    # Running jobs whose lock has expired belonged to a worker that died mid-job
+    now = datetime.now(timezone.utc)
+    return await db.jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "run_after": {"$lte": now}},
+            {"status": "running", "locked_until": {"$lte": now}}
+        ]},
+        {
+            "$set": {"status": "running", "locked_by": WORKER_ID, "locked_until": now + timedelta(seconds=JOB_LOCK_SECONDS)},
+            "$inc": {"attempts": 1}
+        },
+        sort=[("run_after", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def run_job(job: dict):
+    handler = JOB_HANDLERS.get(job['kind'])
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind {job['kind']}")
+        await handler(**job['payload'])
+        await db.jobs.update_one(
+            {"id": job['id']},
+            {"$set": {"status": "done", "finished_at": datetime.now(timezone.utc)}}
+        )
+    except Exception as e:
+        logging.error(f"Job {job['id']} ({job['kind']}) failed: {e}")
+        if job['attempts'] >= JOB_MAX_ATTEMPTS:
+            update = {"status": "failed", "error": str(e), "finished_at": datetime.now(timezone.utc)}
+        else:
+            retry_at = datetime.now(timezone.utc) + timedelta(seconds=5 * 2 ** job['attempts'])
+            update = {"status": "queued", "error": str(e), "run_after": retry_at}
+        await db.jobs.update_one({"id": job['id']}, {"$set": update})
+
+async def process_jobs(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            job = await claim_next_job()
+        except Exception as e:
+            logging.error(f"Error claiming job: {e}")
+            job = None
+        
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        
+        await run_job(job)
+
+def start_background_jobs(stop: asyncio.Event) -> list:
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    
+    global scheduler
+    scheduler = AsyncIOScheduler()
+    scheduler.add_job(run_payment_sweep, 'interval', seconds=PAYMENT_SWEEP_INTERVAL_SECONDS)
+    scheduler.add_job(run_auto_invoice_generation, 'interval', seconds=AUTO_INVOICE_INTERVAL_SECONDS)
+    scheduler.add_job(run_confirmation_tracking, 'interval', seconds=CONFIRMATION_CHECK_SECONDS)
+    scheduler.add_job(run_invoice_archival, 'interval', seconds=ARCHIVE_INTERVAL_SECONDS)
+    scheduler.add_job(run_search_backfill, 'interval', seconds=SEARCH_BACKFILL_INTERVAL_SECONDS, next_run_time=datetime.now(timezone.utc))
+    scheduler.add_job(run_price_refresh, 'interval', seconds=PRICE_REFRESH_SECONDS, next_run_time=datetime.now(timezone.utc))
+    scheduler.start()
+    return [asyncio.create_task(process_jobs(stop)) for _ in range(JOB_CONCURRENCY)]
+
+def shutdown_scheduler():
+    if scheduler is not None:
+        scheduler.shutdown()
+
+async def watch_invoice_changes():
+    pipeline = [{"$match": {
+        "operationType": "update",
+        "updateDescription.updatedFields.status": {"$exists": True}
+    }}]
+    try:
+        async with db.invoices.watch(pipeline, full_document="updateLookup") as stream:
+            invoice_events.change_stream_active = True
+            logging.info("Publishing invoice events from MongoDB change stream")
+            async for change in stream:
+                invoice = change.get("fullDocument")
+                if invoice:
+                    invoice_events.publish(invoice_event(invoice))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # Change streams need a replica set; standalone mongod falls back to in-process events
+        logging.info(f"Invoice change stream unavailable, using in-process events: {e}")
+    finally:
+        invoice_events.change_stream_active = False
+
 app.include_router(api_router)
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    if route is not None and route.path.startswith(api_router.prefix):
+        HTTP_REQUEST_DURATION.labels(
+            request.method, route.path, str(response.status_code)
+        ).observe(time.perf_counter() - started)
+    return response
+
+def bearer_claims(request: Request) -> Optional[dict]:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return token_verifier.verify(token)
+    except JWTError:
+        return None
+
+def profile_debug_allowed(request: Request) -> bool:
+    claims = bearer_claims(request)
+    return claims is not None and claims.get("role") == "admin"
+
+app.middleware("http")(enforce_query_budget)
+app.middleware("http")(RequestProfiler(profile_debug_allowed))
+
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "true").lower() == "true"
+# "memory" limits each process on its own; "mongo" shares limits across workers
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory")
+RATE_LIMIT_DEFAULT_RPS = float(os.environ.get("RATE_LIMIT_DEFAULT_RPS", "20"))
+RATE_LIMIT_DEFAULT_BURST = int(os.environ.get("RATE_LIMIT_DEFAULT_BURST", "40"))
+LOGIN_ATTEMPTS_PER_MINUTE = float(os.environ.get("LOGIN_ATTEMPTS_PER_MINUTE", "5"))
+
+def admission_identity(request: Request) -> str:
+    # Authenticated callers are limited per user, everyone else per client address
+    claims = bearer_claims(request)
+    if claims is not None and (claims.get('uid') or claims.get('sub')):
+        return f"user:{claims.get('uid') or claims['sub']}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+admission_rules = [
+    # Login and registration are bounded by the bcrypt pool
+    Rule("auth", r"^/api/auth/(login|staff/login|register)$", LOGIN_ATTEMPTS_PER_MINUTE / 60,
+         int(LOGIN_ATTEMPTS_PER_MINUTE), concurrency=BCRYPT_POOL_SIZE * 4, methods={"POST"}),
+    Rule("check_payment", r"^/api/invoices/[^/]+/check-payment$", 0.2, 5, concurrency=32, methods={"POST"}),
+    Rule("receipt", r"^/api/invoices/[^/]+/receipt$", 1, 10, concurrency=8, methods={"GET"}),
+    Rule("export", r"^/api/export/", 1 / 60, 3, concurrency=4, methods={"GET"}),
+]
+
+if ADMISSION_CONTROL:
+    app.middleware("http")(AdmissionController(
+        admission_rules,
+        Rule("default", r"^/api/", RATE_LIMIT_DEFAULT_RPS, RATE_LIMIT_DEFAULT_BURST),
+        admission_identity,
+        MongoBuckets(db.rate_limits) if RATE_LIMIT_STORE == "mongo" else MemoryBuckets()
+    ))
+
+# Served outside /api so it is not exposed through the public reverse proxy
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -715,14 +1903,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Set RUN_BACKGROUND_JOBS=false when a dedicated worker (worker.py) runs the
+# scheduler and job queue, so the API process only enqueues work
+RUN_BACKGROUND_JOBS = not API_ONLY and os.environ.get("RUN_BACKGROUND_JOBS", "true").lower() == "true"
+background_stop = asyncio.Event()
+background_tasks = []
+
 @app.on_event("startup")
 async def startup_event():
-    scheduler.add_job(check_pending_payments, 'interval', minutes=2)
-    scheduler.add_job(generate_auto_invoices, 'interval', hours=24)
-    scheduler.start()
-    logger.info("Payment monitoring and auto-invoice generation started")
+    global change_stream_task
+    change_stream_task = asyncio.create_task(watch_invoice_changes())
+    background_tasks.append(asyncio.create_task(follow_revocations(background_stop)))
+    if RUN_BACKGROUND_JOBS:
+        await ensure_job_indexes()
+        background_tasks.extend(start_background_jobs(background_stop))
+        logger.info("Payment monitoring and auto-invoice generation started")
+    else:
+        background_tasks.append(asyncio.create_task(follow_price_history(background_stop)))
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    scheduler.shutdown()
+    if change_stream_task:
+        change_stream_task.cancel()
+    background_stop.set()
+    if RUN_BACKGROUND_JOBS:
+        shutdown_scheduler()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if RUN_BACKGROUND_JOBS:
+        try:
+            await release_job_leases()
+        except Exception as e:
+            logger.error(f"Error releasing job leases: {e}")
+    bcrypt_pool.shutdown(wait=False)
     client.close()
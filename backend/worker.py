@@ -0,0 +1,39 @@
+import asyncio
+import signal
+
+from server import (
+    client,
+    ensure_job_indexes,
+    logger,
+    release_job_leases,
+    shutdown_scheduler,
+    start_background_jobs,
+)
+
+# Dedicated background worker: runs the payment sweep, auto-invoice generation
+# and queued jobs (receipt rendering) outside the API process.
+# Start the API with RUN_BACKGROUND_JOBS=false and run: python worker.py
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    await ensure_job_indexes()
+    tasks = start_background_jobs(stop)
+    logger.info("Background worker started")
+    
+    await stop.wait()
+    
+    shutdown_scheduler()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    try:
+        await release_job_leases()
+    except Exception as e:
+        logger.error(f"Error releasing job leases: {e}")
+    client.close()
+    logger.info("Background worker stopped")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+# Offline load benchmark for the backend API.
+#
+# Runs the FastAPI app in-process (no uvicorn, no network) against either a
+# mongomock-motor stand-in or a local mongod, with the blockchain providers
+# replaced by a fake chain backend. Results are written as a JSON baseline
+# that later runs can be compared against:
+#
+#   python backend_benchmark.py --output bench_baseline.json
+#   python backend_benchmark.py --compare bench_baseline.json
+#   python backend_benchmark.py --mongo local --invoices 50000 --concurrency 64
+#
+# mongomock (the default) differs from MongoDB where it matters here; see
+# MOCK_LIMITATIONS. Use --mongo local for numbers that reflect production.
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "cryptobill_benchmark")
+# The benchmark drives the sweep itself; never start the scheduler or job consumers
+os.environ["RUN_BACKGROUND_JOBS"] = "false"
+os.environ.setdefault("PRICE_FEED", "fixture")
+# Benchmark clients share a handful of tokens; rate limits would cap the load
+os.environ.setdefault("ADMISSION_CONTROL", "false")
+# Seeded invoices are a minute apart, so large runs would push most of them
+# onto the hourly stale cadence; keep every sweep run checking all of them
+os.environ.setdefault("SWEEP_STALE_AFTER_DAYS", "0")
+
+import httpx
+import query_budget
+import server
+
+PASSWORD = "BenchPass123!"
+CURRENCIES = ["LTC", "USDT", "USDC"]
+HEAVY_MODULES = ["web3", "reportlab", "apscheduler", "httpx"]
+
+STARTUP_PROBE = f"""
+import json, resource, sys, time
+started = time.perf_counter()
+import server
+print(json.dumps({{
+    "import_seconds": time.perf_counter() - started,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "heavy_modules": [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+}}))
+"""
+
+def measure_startup(api_only: bool, runs: int) -> dict:
+    # Fresh interpreter per run so module caches do not hide import cost
+    env = {**os.environ, "API_ONLY": "true" if api_only else "false"}
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "import_ms": round(statistics.median(s["import_seconds"] for s in samples) * 1000, 3),
+        "max_rss_kb": statistics.median(s["max_rss_kb"] for s in samples),
+        "heavy_modules_loaded": samples[-1]["heavy_modules"]
+    }
+
+class FakeChain:
+    # Stands in for BlockCypher/Infura: fixed latency, and a chosen set of
+    # addresses that hold enough balance to settle any invoice
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+        self.funded = set()
+        self.calls = 0
+
+    async def balance(self, address: str, currency: str):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return 1e9 if (currency, address) in self.funded else 0.0
+
+    async def latest_tx(self, address: str, currency: str):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return {"tx_hash": f"0x{uuid.uuid4().hex}", "block_height": 1000}
+
+MOCK_LIMITATIONS = [
+    "search_typeahead: $all with regexes matches nothing, so searches come back empty",
+    "payment_sweep: conditional find_one_and_update with a projection returns None, so "
+    "settle_invoice never wins and no payments or receipt jobs are recorded",
+]
+
+def use_database(backend: str, db_name: str):
+    if backend == "mock":
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient()
+    server.db = server.InstrumentedDatabase(server.client[db_name])
+    if backend == "mock":
+        # mongomock has no read preferences or write concerns to apply
+        server.analytics_db = server.durable_db = server.cache_db = server.db
+    else:
+        server.configure_database_views()
+
+async def seed(args, chain: FakeChain):
+    rng = random.Random(args.seed)
+    db = server.db
+    for name in ["users", "staff", "invoices", "receipts", "jobs", "auto_invoices"]:
+        await db[name].delete_many({})
+
+    # One shared hash keeps seeding fast; logins still pay the full bcrypt verify
+    hashed = server.hash_password(PASSWORD)
+    now = datetime.now(timezone.utc)
+
+    admin = {
+        "id": str(uuid.uuid4()),
+        "email": "admin@example.com",
+        "full_name": "Bench Admin",
+        "role": "admin",
+        "created_at": now.isoformat(),
+        "password": hashed
+    }
+    clients = [{
+        "id": str(uuid.uuid4()),
+        "email": f"client{i}@example.com",
+        "full_name": f"Client {i}",
+        "role": "client",
+        "created_at": now.isoformat(),
+        "password": hashed
+    } for i in range(args.clients)]
+    await db.users.insert_many([admin] + clients)
+
+    staff = []
+    for i in range(args.staff):
+        member = server.Staff(
+            name=f"Staff {i}",
+            email=f"staff{i}@example.com",
+            ltc_address=f"ltc1bench{i:06d}",
+            usdt_address=f"0x{i:040x}",
+            usdc_address=f"0x{i + 10 ** 6:040x}"
+        ).model_dump()
+        member['created_at'] = member['created_at'].isoformat()
+        member['password'] = hashed
+        staff.append(member)
+    await db.staff.insert_many([dict(member) for member in staff])
+
+    for member in rng.sample(staff, max(1, int(len(staff) * args.funded_ratio))):
+        chain.funded.update({
+            ("LTC", member['ltc_address']),
+            ("USDT", member['usdt_address']),
+            ("USDC", member['usdc_address'])
+        })
+
+    invoices = []
+    paid_ids = []
+    for i in range(args.invoices):
+        member = rng.choice(staff)
+        currency = rng.choice(CURRENCIES)
+        created_at = now - timedelta(minutes=i)
+        invoice = server.Invoice(
+            staff_id=member['id'],
+            client_id=rng.choice(clients)['id'],
+            amount=round(rng.uniform(5, 500), 2),
+            currency=currency,
+            description=f"Benchmark invoice {i}",
+            payment_address=member[f"{currency.lower()}_address"],
+            created_at=created_at
+        ).model_dump()
+        invoice['created_at'] = created_at.isoformat()
+        if rng.random() < args.paid_ratio:
+            invoice['status'] = "paid"
+            invoice['paid_at'] = created_at.isoformat()
+            invoice['tx_hash'] = f"0x{uuid.uuid4().hex}"
+            paid_ids.append(invoice['id'])
+        invoices.append(invoice)
+
+    for start in range(0, len(invoices), 5000):
+        await db.invoices.insert_many(invoices[start:start + 5000])
+    await server.backfill_search_terms()
+
+    return admin, clients, staff, paid_ids
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0
+    }
+
+async def run_scenario(http: httpx.AsyncClient, make_request, total: int, concurrency: int, expect=None) -> dict:
+    latencies = []
+    errors = 0
+    # Successful responses that fail the scenario's expectation (e.g. empty results)
+    unexpected = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors, unexpected
+        for _ in remaining:
+            method, url, kwargs = make_request()
+            started = time.perf_counter()
+            response = await http.request(method, url, **kwargs)
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+                if expect is not None and not expect(response):
+                    unexpected += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return {**summarize(latencies, errors, time.perf_counter() - started), "unexpected": unexpected}
+
+def auth(token: str) -> dict:
+    return {"headers": {"Authorization": f"Bearer {token}"}}
+
+async def run_benchmark(args) -> dict:
+    chain = FakeChain(args.chain_latency_ms)
+    server.fetch_address_balance = chain.balance
+    server.fetch_latest_tx = chain.latest_tx
+    use_database(args.mongo, args.db_name)
+    if args.mongo == "mock":
+        print("WARNING: mongomock is not MongoDB; these results are affected:")
+        for limitation in MOCK_LIMITATIONS:
+            print(f"  - {limitation}")
+
+    seed_started = time.perf_counter()
+    admin, clients, staff, paid_ids = await seed(args, chain)
+    seed_seconds = time.perf_counter() - seed_started
+
+    rng = random.Random(args.seed)
+    admin_token = server.create_access_token(server.user_claims(server.User(**admin)))
+    client_tokens = [server.create_access_token(server.user_claims(server.User(**c))) for c in clients]
+    staff_tokens = [server.create_access_token(server.user_claims(server.staff_user(dict(s)))) for s in staff]
+
+    scenarios = {
+        "login": (lambda: ("POST", "/api/auth/login", {"json": {
+            "email": rng.choice(clients)['email'], "password": PASSWORD
+        }}), args.login_requests),
+        "list_invoices_admin": (lambda: ("GET", "/api/invoices", auth(admin_token)), args.requests),
+        "list_invoices_client": (lambda: ("GET", "/api/invoices", auth(rng.choice(client_tokens))), args.requests),
+        "dashboard_stats_admin": (lambda: ("GET", "/api/dashboard/stats", auth(admin_token)), args.requests),
+        "dashboard_stats_staff": (lambda: ("GET", "/api/dashboard/stats", auth(rng.choice(staff_tokens))), args.requests),
+        "search_typeahead": (lambda: ("GET", "/api/search", {
+            "params": {"q": f"client{rng.randrange(args.clients)}"[:rng.randint(3, 8)]}, **auth(admin_token)
+        }), args.requests, lambda response: any(response.json().values())),
+        "export_invoices_csv": (lambda: ("GET", "/api/export/invoices", auth(admin_token)), args.export_requests),
+    }
+    if paid_ids:
+        scenarios["download_receipt"] = (lambda: (
+            "GET", f"/api/invoices/{rng.choice(paid_ids)}/receipt", auth(admin_token)
+        ), args.requests)
+
+    results = {}
+    # Server errors (including strict query-budget failures) count as errors, not crashes
+    transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for name, (make_request, total, *expect) in scenarios.items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = await run_scenario(http, make_request, total, args.concurrency, *expect)
+            print(f"{name:24} {results[name]['throughput_rps']:>9} req/s  "
+                  f"p50 {results[name]['p50_ms']:>8} ms  p99 {results[name]['p99_ms']:>8} ms  "
+                  f"errors {results[name]['errors']}")
+            if results[name]['unexpected']:
+                print(f"WARNING: {name}: {results[name]['unexpected']} responses had empty or unexpected "
+                      f"results; its timings do not measure the real work")
+
+    if not args.only or "payment_sweep" in args.only:
+        sweeps = []
+        for _ in range(args.sweep_runs):
+            calls_before = chain.calls
+            paid_before = await server.db.invoices.count_documents({"status": "paid"})
+            recorded_before = await server.db.payments.count_documents({})
+            started = time.perf_counter()
+            await server.check_pending_payments()
+            elapsed = time.perf_counter() - started
+            paid_after = await server.db.invoices.count_documents({"status": "paid"})
+            sweeps.append({
+                "duration_ms": round(elapsed * 1000, 3),
+                "settled": paid_after - paid_before,
+                # Settlements whose follow-up work (payment record, receipt job) ran
+                "recorded": await server.db.payments.count_documents({}) - recorded_before,
+                "chain_calls": chain.calls - calls_before
+            })
+        durations = sorted(s['duration_ms'] / 1000 for s in sweeps)
+        results["payment_sweep"] = {
+            **summarize(durations, 0, sum(durations)),
+            "runs": sweeps
+        }
+        print(f"{'payment_sweep':24} p50 {results['payment_sweep']['p50_ms']:>8} ms  "
+              f"settled {sum(s['settled'] for s in sweeps)}  recorded {sum(s['recorded'] for s in sweeps)}")
+        if sum(s['recorded'] for s in sweeps) < sum(s['settled'] for s in sweeps):
+            print("WARNING: payment_sweep: some settlements recorded no payment; sweep timings "
+                  "leave out payment recording and receipt jobs")
+
+    if args.mongo == "local":
+        await server.client.drop_database(args.db_name)
+
+    startup = {}
+    if args.startup_runs:
+        for mode, api_only in (("default", False), ("api_only", True)):
+            startup[mode] = measure_startup(api_only, args.startup_runs)
+            print(f"{'startup_' + mode:24} import {startup[mode]['import_ms']:>9} ms  "
+                  f"rss {startup[mode]['max_rss_kb']} KB  heavy {startup[mode]['heavy_modules_loaded']}")
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "mongo": args.mongo,
+            "mongo_limitations": MOCK_LIMITATIONS if args.mongo == "mock" else [],
+            "clients": args.clients,
+            "staff": args.staff,
+            "invoices": args.invoices,
+            "paid_ratio": args.paid_ratio,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "login_requests": args.login_requests,
+            "chain_latency_ms": args.chain_latency_ms,
+            "seed": args.seed
+        },
+        "seed_seconds": round(seed_seconds, 3),
+        "startup": startup,
+        "scenarios": results
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float) -> bool:
+    # A scenario regresses when p99 grows or throughput drops by more than tolerance
+    ok = True
+    print("\nComparison with baseline:")
+    for name, result in current["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            print(f"  {name:24} (no baseline)")
+            continue
+        p99_change = (result["p99_ms"] - previous["p99_ms"]) / previous["p99_ms"] if previous["p99_ms"] else 0.0
+        rps_change = (result["throughput_rps"] - previous["throughput_rps"]) / previous["throughput_rps"] if previous["throughput_rps"] else 0.0
+        regressed = p99_change > tolerance or rps_change < -tolerance
+        ok = ok and not regressed
+        marker = "REGRESSION" if regressed else "ok"
+        print(f"  {name:24} p99 {p99_change:+.1%}  throughput {rps_change:+.1%}  {marker}")
+    for mode, result in current.get("startup", {}).items():
+        previous = baseline.get("startup", {}).get(mode)
+        if not previous or not previous["import_ms"]:
+            continue
+        import_change = (result["import_ms"] - previous["import_ms"]) / previous["import_ms"]
+        regressed = import_change > tolerance
+        ok = ok and not regressed
+        marker = "REGRESSION" if regressed else "ok"
+        print(f"  {'startup_' + mode:24} import {import_change:+.1%}  {marker}")
+    return ok
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline API load benchmark")
+    parser.add_argument("--mongo", choices=["mock", "local"], default="mock",
+                        help="mongomock-motor stand-in or the mongod at MONGO_URL")
+    parser.add_argument("--db-name", default="cryptobill_benchmark",
+                        help="database used (and dropped) with --mongo local")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--staff", type=int, default=20)
+    parser.add_argument("--invoices", type=int, default=5000)
+    parser.add_argument("--paid-ratio", type=float, default=0.5)
+    parser.add_argument("--funded-ratio", type=float, default=0.2,
+                        help="share of staff whose addresses the fake chain reports as funded")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--export-requests", type=int, default=20, help="full invoice exports to run")
+    parser.add_argument("--login-requests", type=int, default=100)
+    parser.add_argument("--sweep-runs", type=int, default=3)
+    parser.add_argument("--chain-latency-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--startup-runs", type=int, default=3,
+                        help="cold imports of server.py to time per mode (0 to skip)")
+    parser.add_argument("--only", nargs="*", help="run only these scenarios")
+    parser.add_argument("--strict-budgets", action="store_true",
+                        help="fail requests that exceed their declared query budget")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline JSON to diff against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.strict_budgets:
+        query_budget.QUERY_BUDGET_STRICT = True
+    results = asyncio.run(run_benchmark(args))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        return 0 if compare(results, baseline, args.tolerance) else 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
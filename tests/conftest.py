@@ -0,0 +1,27 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend is a flat set of modules run from backend/, so tests import
+# them the same way uvicorn and worker.py do
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "cryptobill_test")
+os.environ.setdefault("RUN_BACKGROUND_JOBS", "false")
+os.environ.setdefault("PRICE_FEED", "fixture")
+os.environ.setdefault("ADMISSION_CONTROL", "false")
+
+@pytest.fixture
+def server(monkeypatch):
+    # server.py bound to a fresh mongomock database instead of MONGO_URL
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server as server_module
+    
+    database = server_module.InstrumentedDatabase(mongomock_motor.AsyncMongoMockClient()["cryptobill_test"])
+    for name in ("db", "analytics_db", "durable_db", "cache_db"):
+        monkeypatch.setattr(server_module, name, database)
+    monkeypatch.setattr(server_module, "pending_index", server_module.PendingIndex())
+    return server_module
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from fastapi.responses import StreamingResponse
+
+from admission import AdmissionController, MemoryBuckets, Rule
+
+def export_request():
+    return SimpleNamespace(method="GET", url=SimpleNamespace(path="/api/export/invoices"))
+
+def controller(concurrency: int) -> AdmissionController:
+    rule = Rule("export", r"^/api/export/", 1000, 1000, concurrency=concurrency)
+    default = Rule("default", r"^/api/", 1000, 1000)
+    return AdmissionController([rule], default, lambda request: "caller", MemoryBuckets())
+
+def test_concurrency_slot_is_held_until_the_streamed_body_ends():
+    admission = controller(concurrency=1)
+    
+    async def call_next(request):
+        async def rows():
+            yield "id,amount\n"
+            yield "1,10\n"
+        return StreamingResponse(rows(), media_type="text/csv")
+    
+    async def run():
+        first = await admission(export_request(), call_next)
+        # Headers are out but the body has not been sent yet
+        blocked = await admission(export_request(), call_next)
+        body = [chunk async for chunk in first.body_iterator]
+        admitted = await admission(export_request(), call_next)
+        return blocked, body, admitted
+    
+    blocked, body, admitted = asyncio.run(run())
+    
+    assert blocked.status_code == 429
+    assert body == ["id,amount\n", "1,10\n"]
+    assert admitted.status_code == 200
+    assert admission.inflight["export"] == 1
+
+def test_concurrency_slot_is_released_when_the_body_fails():
+    admission = controller(concurrency=1)
+    
+    async def call_next(request):
+        async def rows():
+            yield "id,amount\n"
+            raise RuntimeError("cursor lost")
+        return StreamingResponse(rows(), media_type="text/csv")
+    
+    async def run():
+        response = await admission(export_request(), call_next)
+        try:
+            async for _ in response.body_iterator:
+                pass
+        except RuntimeError:
+            pass
+    
+    asyncio.run(run())
+    
+    assert admission.inflight["export"] == 0
+
+def test_memory_buckets_admit_the_burst_then_ask_to_retry():
+    buckets = MemoryBuckets()
+    rule = Rule("login", r"^/api/auth/login$", 0.5, 3)
+    
+    async def run():
+        return [await buckets.take(rule, "caller") for _ in range(4)]
+    
+    waits = asyncio.run(run())
+    
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert 1.9 < waits[3] <= 2.0
+    # Another caller has its own bucket
+    assert asyncio.run(buckets.take(rule, "someone-else")) == 0.0
+
+def test_memory_buckets_evict_the_least_recently_updated_over_the_cap():
+    buckets = MemoryBuckets(max_buckets=2)
+    rule = Rule("login", r"^/api/auth/login$", 0.5, 1)
+    
+    async def run():
+        await buckets.take(rule, "first")
+        await buckets.take(rule, "second")
+        # Touching "first" again makes "second" the stalest
+        blocked = await buckets.take(rule, "first")
+        await buckets.take(rule, "third")
+        return blocked
+    
+    assert asyncio.run(run()) > 0
+    assert list(buckets.buckets) == [("login", "first"), ("login", "third")]
+
+def test_memory_buckets_stay_cheap_with_more_callers_than_the_cap():
+    buckets = MemoryBuckets(max_buckets=10_000)
+    rule = Rule("login", r"^/api/auth/login$", 5 / 60, 5)
+    
+    async def run():
+        for caller in range(15_000):
+            await buckets.take(rule, f"10.0.{caller // 256}.{caller % 256}")
+    
+    started = time.perf_counter()
+    asyncio.run(run())
+    
+    assert time.perf_counter() - started < 2.0
+    assert len(buckets.buckets) == 10_000
@@ -0,0 +1,72 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from jose import JWTError
+
+from auth_tokens import RevocationList, SigningKeys, TokenVerifier
+
+@pytest.fixture
+def revoked_tokens():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient()["cryptobill_test"].revoked_tokens
+
+def revoke(revoked_tokens, revoked_at: datetime) -> str:
+    jti = str(uuid.uuid4())
+    asyncio.run(revoked_tokens.insert_one({
+        "_id": jti, "revoked_at": revoked_at, "expires_at": revoked_at + timedelta(hours=1)
+    }))
+    return jti
+
+def test_incremental_sync_picks_up_revocations_stamped_before_the_watermark(revoked_tokens):
+    revocations = RevocationList()
+    asyncio.run(revocations.sync(revoked_tokens, full=True))
+    # Written by a process whose clock runs behind, or committed after the last sync read
+    jti = revoke(revoked_tokens, revocations.watermark - timedelta(seconds=10))
+    
+    asyncio.run(revocations.sync(revoked_tokens))
+    
+    assert {"jti": jti} in revocations
+
+def claims(**extra) -> dict:
+    return {"sub": "client@example.com", "jti": str(uuid.uuid4()), "exp": int(time.time()) + 3600, **extra}
+
+def test_verifier_caches_claims_but_still_checks_revocation():
+    keys = SigningKeys({"default": "secret"}, "default")
+    revocations = RevocationList()
+    verifier = TokenVerifier(keys, revocations)
+    token_claims = claims()
+    token = keys.encode(token_claims)
+    
+    assert verifier.verify(token)['jti'] == token_claims['jti']
+    assert len(verifier.cache) == 1
+    
+    revocations.add(token_claims['jti'])
+    with pytest.raises(JWTError):
+        verifier.verify(token)
+
+def test_verifier_rejects_expired_and_unknown_key_tokens():
+    keys = SigningKeys({"default": "secret"}, "default")
+    verifier = TokenVerifier(keys, RevocationList())
+    
+    with pytest.raises(JWTError):
+        verifier.verify(keys.encode(claims(exp=int(time.time()) - 1)))
+    with pytest.raises(JWTError):
+        verifier.verify(SigningKeys({"retired": "old"}, "retired").encode(claims()))
+
+def test_tokens_signed_before_rotation_still_verify():
+    old_keys = SigningKeys({"default": "secret", "2024-06": "a"}, "2024-06")
+    token = old_keys.encode(claims())
+    rotated = SigningKeys({"default": "secret", "2024-06": "a", "2024-12": "b"}, "2024-12")
+    
+    assert TokenVerifier(rotated, RevocationList()).verify(token)['sub'] == "client@example.com"
+
+def test_verifier_cache_is_bounded():
+    keys = SigningKeys({"default": "secret"}, "default")
+    verifier = TokenVerifier(keys, RevocationList(), cache_size=2)
+    for _ in range(3):
+        verifier.verify(keys.encode(claims()))
+    
+    assert len(verifier.cache) == 2
@@ -0,0 +1,29 @@
+import asyncio
+import json
+
+INVOICE_ID = "30000000-0000-4000-8000-000000000000"
+
+ARCHIVED_INVOICE = {
+    "id": INVOICE_ID, "client_id": "client", "staff_id": "staff", "status": "paid",
+    "currency": "LTC", "amount": 1.0, "tx_hash": "0xpaid"
+}
+
+def client_user(server):
+    return server.User(id="client", email="client@example.com", full_name="Client", role="client")
+
+def test_check_payment_on_archived_invoice_reports_already_paid(server):
+    async def run():
+        await server.db.invoices_archive.insert_one(dict(ARCHIVED_INVOICE))
+        return await server.check_payment(INVOICE_ID, client_user(server))
+    
+    assert asyncio.run(run()) == {"status": "paid", "message": "Invoice already paid"}
+
+def test_archived_invoice_stream_reports_paid(server):
+    async def run():
+        await server.db.invoices_archive.insert_one(dict(ARCHIVED_INVOICE))
+        response = await server.stream_invoice_events(INVOICE_ID, client_user(server))
+        return [message async for message in response.body_iterator]
+    
+    messages = asyncio.run(run())
+    
+    assert [json.loads(message.split("data: ", 1)[1])['status'] for message in messages] == ["paid"]
@@ -0,0 +1,161 @@
+import asyncio
+import json
+
+INVOICE_ID = "20000000-0000-4000-8000-000000000000"
+
+def sse_data(message: str) -> dict:
+    return json.loads(message.split("data: ", 1)[1])
+
+async def collect(stream) -> list:
+    return [message async for message in stream]
+
+def client_user(server):
+    return server.User(id="client", email="client@example.com", full_name="Client", role="client")
+
+def test_stream_reports_payment_made_before_the_stream_started(server):
+    async def run():
+        await server.db.invoices.insert_one({"id": INVOICE_ID, "client_id": "client", "staff_id": "staff", "status": "pending"})
+        stream = server.invoice_event_stream(client_user(server), INVOICE_ID)
+        # Settled after the handler's lookup but before the body is streamed;
+        # the published event has no subscriber yet
+        await server.db.invoices.update_one({"id": INVOICE_ID}, {"$set": {"status": "paid", "tx_hash": "0xpaid"}})
+        server.publish_invoice_event({"id": INVOICE_ID, "client_id": "client", "status": "paid"})
+        return await asyncio.wait_for(collect(stream), timeout=5)
+    
+    messages = asyncio.run(run())
+    
+    assert [sse_data(message)['status'] for message in messages] == ["paid"]
+
+def test_stream_polls_settlements_from_other_processes_without_change_stream(server, monkeypatch):
+    monkeypatch.setattr(server, "SSE_KEEPALIVE_SECONDS", 0.05)
+    server.invoice_events.change_stream_active = False
+    
+    async def run():
+        await server.db.invoices.insert_one({"id": INVOICE_ID, "client_id": "client", "staff_id": "staff", "status": "pending"})
+        stream = server.invoice_event_stream(client_user(server), INVOICE_ID)
+        first = await stream.__anext__()
+        # The worker settles the invoice; nothing is published in this process
+        await server.db.invoices.update_one({"id": INVOICE_ID}, {"$set": {"status": "paid", "tx_hash": "0xpaid"}})
+        return [first] + await asyncio.wait_for(collect(stream), timeout=5)
+    
+    messages = [message for message in asyncio.run(run()) if message.startswith("event:")]
+    
+    assert [sse_data(message)['status'] for message in messages] == ["pending", "paid"]
+
+def test_all_invoices_stream_delivers_each_settlement_once(server, monkeypatch):
+    monkeypatch.setattr(server, "SSE_KEEPALIVE_SECONDS", 0.05)
+    server.invoice_events.change_stream_active = False
+    admin = server.User(id="admin", email="admin@example.com", full_name="Admin", role="admin")
+    
+    async def run():
+        stream = server.invoice_event_stream(admin)
+        received = []
+        
+        async def consume():
+            async for message in stream:
+                if message.startswith("event:"):
+                    received.append(sse_data(message))
+        
+        consumer = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        paid = {
+            "id": INVOICE_ID, "client_id": "client", "staff_id": "staff", "status": "paid",
+            "paid_at": server.datetime.now(server.timezone.utc).isoformat()
+        }
+        await server.db.invoices.insert_one(dict(paid))
+        # Settled in this process: published locally and also visible to the poll
+        server.publish_invoice_event(paid)
+        await asyncio.sleep(0.3)
+        consumer.cancel()
+        return received
+    
+    received = asyncio.run(run())
+    
+    assert [(event['invoice_id'], event['status']) for event in received] == [(INVOICE_ID, "paid")]
+
+def test_stream_polls_while_other_invoices_keep_the_bus_busy(server, monkeypatch):
+    monkeypatch.setattr(server, "SSE_KEEPALIVE_SECONDS", 0.05)
+    server.invoice_events.change_stream_active = False
+    
+    async def run():
+        await server.db.invoices.insert_one({"id": INVOICE_ID, "client_id": "client", "staff_id": "staff", "status": "pending"})
+        stream = server.invoice_event_stream(client_user(server), INVOICE_ID)
+        first = await stream.__anext__()
+        await server.db.invoices.update_one({"id": INVOICE_ID}, {"$set": {"status": "paid", "tx_hash": "0xpaid"}})
+        
+        async def publish_unrelated():
+            while True:
+                server.invoice_events.publish({"invoice_id": "other", "status": "pending", "client_id": "someone-else"})
+                await asyncio.sleep(0.03)
+        
+        publisher = asyncio.create_task(publish_unrelated())
+        try:
+            return [first] + await asyncio.wait_for(collect(stream), timeout=1)
+        finally:
+            publisher.cancel()
+    
+    messages = [message for message in asyncio.run(run()) if message.startswith("event:")]
+    
+    assert [sse_data(message)['status'] for message in messages] == ["pending", "paid"]
+
+def test_all_invoices_stream_forgets_settlements_outside_the_poll_window(server, monkeypatch):
+    monkeypatch.setattr(server, "SSE_KEEPALIVE_SECONDS", 0.05)
+    monkeypatch.setattr(server, "SSE_POLL_OVERLAP_SECONDS", 0.2)
+    server.invoice_events.change_stream_active = False
+    admin = server.User(id="admin", email="admin@example.com", full_name="Admin", role="admin")
+    
+    async def run():
+        stream = server.invoice_event_stream(admin)
+        received = []
+        
+        async def consume():
+            async for message in stream:
+                if message.startswith("event:"):
+                    received.append(sse_data(message)['invoice_id'])
+        
+        consumer = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        await server.db.invoices.insert_one({
+            "id": INVOICE_ID, "client_id": "client", "staff_id": "staff", "status": "paid",
+            "paid_at": server.datetime.now(server.timezone.utc).isoformat()
+        })
+        await asyncio.sleep(0.6)
+        delivered = stream.ag_frame.f_locals['delivered']
+        consumer.cancel()
+        return received, delivered
+    
+    received, delivered = asyncio.run(run())
+    
+    assert received == [INVOICE_ID]
+    assert delivered == {}
+
+def test_queued_payment_check_result_reaches_the_stream(server, monkeypatch):
+    # API_ONLY: the API queues the check, the worker settles, the API's stream reports it
+    monkeypatch.setattr(server, "API_ONLY", True)
+    monkeypatch.setattr(server, "SSE_KEEPALIVE_SECONDS", 0.05)
+    monkeypatch.setattr(server, "recent_payment_checks", {})
+    server.invoice_events.change_stream_active = False
+    
+    async def detect_invoice_payment(invoice):
+        return {"detected": True, "tx_hash": "0xpaid"}
+    
+    monkeypatch.setattr(server, "detect_invoice_payment", detect_invoice_payment)
+    
+    async def run():
+        await server.db.invoices.insert_one({
+            "id": INVOICE_ID, "client_id": "client", "staff_id": "staff", "status": "pending",
+            "currency": "LTC", "amount": 1.0, "payment_address": "ltc1qqueued"
+        })
+        response = await server.check_payment(INVOICE_ID, client_user(server))
+        assert response["message"] == "Payment check queued"
+        
+        stream = server.invoice_event_stream(client_user(server), INVOICE_ID)
+        first = await stream.__anext__()
+        
+        job = await server.db.jobs.find_one({"kind": "check_payment"})
+        await server.JOB_HANDLERS[job['kind']](**job['payload'])
+        return [first] + await asyncio.wait_for(collect(stream), timeout=5)
+    
+    messages = [message for message in asyncio.run(run()) if message.startswith("event:")]
+    
+    assert [sse_data(message)['status'] for message in messages] == ["pending", "paid"]
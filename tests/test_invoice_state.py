@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from invoice_state import InvalidTransition, mark_invoice_paid, transition_invoice
+
+INVOICE_ID = "40000000-0000-4000-8000-000000000000"
+
+@pytest.fixture
+def invoices():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    collection = mongomock_motor.AsyncMongoMockClient()["cryptobill_test"].invoices
+    asyncio.run(collection.insert_one({"id": INVOICE_ID, "status": "pending"}))
+    return collection
+
+def test_transition_outside_the_state_machine_is_rejected(invoices):
+    with pytest.raises(InvalidTransition):
+        asyncio.run(transition_invoice(invoices, INVOICE_ID, "paid", "pending"))
+    
+    assert asyncio.run(invoices.find_one({"id": INVOICE_ID}))['status'] == "pending"
+
+def test_only_the_first_of_two_racing_settlements_lands(invoices):
+    async def run():
+        await mark_invoice_paid(invoices, INVOICE_ID, "0xfirst")
+        second = await mark_invoice_paid(invoices, INVOICE_ID, "0xsecond")
+        return second, await invoices.find_one({"id": INVOICE_ID}, {"_id": 0})
+    
+    second, invoice = asyncio.run(run())
+    
+    assert second is None
+    assert invoice['status'] == "paid"
+    assert invoice['tx_hash'] == "0xfirst"
+    assert invoice['paid_at']
+
+def test_transition_of_a_missing_invoice_returns_none(invoices):
+    assert asyncio.run(mark_invoice_paid(invoices, "missing", "0xpaid")) is None
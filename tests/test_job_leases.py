@@ -0,0 +1,28 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+def test_lease_is_renewed_by_its_holder_and_refused_to_others(server, monkeypatch):
+    async def run():
+        first = await server.acquire_job_lease("payment_sweep", 60)
+        renewed = await server.acquire_job_lease("payment_sweep", 60)
+        monkeypatch.setattr(server, "WORKER_ID", "other-worker")
+        other = await server.acquire_job_lease("payment_sweep", 60)
+        return first, renewed, other
+    
+    assert asyncio.run(run()) == (True, True, False)
+
+def test_expired_lease_is_taken_over(server, monkeypatch):
+    async def run():
+        await server.acquire_job_lease("payment_sweep", 60)
+        await server.db.job_leases.update_one(
+            {"_id": "payment_sweep"},
+            {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+        )
+        monkeypatch.setattr(server, "WORKER_ID", "other-worker")
+        taken = await server.acquire_job_lease("payment_sweep", 60)
+        return taken, await server.db.job_leases.find_one({"_id": "payment_sweep"})
+    
+    taken, lease = asyncio.run(run())
+    
+    assert taken is True
+    assert lease['owner'] == "other-worker"
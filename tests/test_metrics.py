@@ -0,0 +1,16 @@
+from types import SimpleNamespace
+
+from metrics import MongoCommandMetrics
+
+def command_started(command_name, command, request_id=1):
+    return SimpleNamespace(command_name=command_name, command=command, connection_id=("localhost", 27017), request_id=request_id)
+
+def test_command_labels_use_the_collection_name():
+    listener = MongoCommandMetrics()
+    listener.started(command_started("find", {"find": "invoices", "filter": {}}, 1))
+    listener.started(command_started("getMore", {"getMore": 1234, "collection": "invoices"}, 2))
+    listener.started(command_started("ping", {"ping": 1}, 3))
+    
+    labels = {request_id: collection for (_, request_id), (collection, _) in listener.inflight.items()}
+    
+    assert labels == {1: "invoices", 2: "invoices", 3: "admin"}
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from price_oracle import FixtureFeed, PriceOracle
+
+INVOICE_ID = "50000000-0000-4000-8000-000000000000"
+ADDRESSES = {"LTC": "ltc1qmulticurrency", "USDT": "0xmulticurrency"}
+
+def crypto_invoice(amount_usd: float = 50.0) -> dict:
+    return {
+        "id": INVOICE_ID, "staff_id": "staff", "client_id": "client", "currency": "CRYPTO",
+        "amount": amount_usd, "payment_addresses": dict(ADDRESSES), "description": "Multi-currency",
+        "status": "pending", "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+@pytest.fixture
+def chain(server, monkeypatch):
+    # Address balances served to the detector; prices come from a fresh fixture snapshot
+    balances = {}
+    
+    async def fetch_address_balance(address, currency):
+        return balances.get((currency, address))
+    
+    async def fetch_latest_tx(address, currency):
+        return {"tx_hash": f"0x{currency.lower()}paid", "block_height": 100}
+    
+    oracle = PriceOracle(FixtureFeed({"LTC": 100.0, "USDT": 1.0}), max_age_seconds=300)
+    asyncio.run(oracle.refresh())
+    monkeypatch.setattr(server, "price_oracle", oracle)
+    monkeypatch.setattr(server, "fetch_address_balance", fetch_address_balance)
+    monkeypatch.setattr(server, "fetch_latest_tx", fetch_latest_tx)
+    return balances
+
+def test_usd_amount_is_converted_at_the_oracle_price(server, chain):
+    chain[("LTC", ADDRESSES["LTC"])] = 0.49
+    assert asyncio.run(server.detect_invoice_payment(crypto_invoice(50.0))) is None
+    
+    chain[("LTC", ADDRESSES["LTC"])] = 0.5
+    payment = asyncio.run(server.detect_invoice_payment(crypto_invoice(50.0)))
+    
+    assert payment['tx_hash'] == "0xltcpaid"
+    assert payment['settlement'] == {"paid_currency": "LTC", "payment_address": ADDRESSES["LTC"], "usd_price": 100.0}
+
+def test_currency_with_a_stale_price_is_skipped(server, chain):
+    chain[("LTC", ADDRESSES["LTC"])] = 10.0
+    chain[("USDT", ADDRESSES["USDT"])] = 50.0
+    stale = datetime.now(timezone.utc) - timedelta(seconds=301)
+    server.price_oracle.fetched_at = None
+    server.price_oracle.apply({"LTC": 100.0}, stale)
+    
+    assert asyncio.run(server.detect_invoice_payment(crypto_invoice(50.0))) is None
+    
+    # A fresh snapshot without LTC: only the USDT address can settle
+    server.price_oracle.apply({"USDT": 1.0}, datetime.now(timezone.utc))
+    payment = asyncio.run(server.detect_invoice_payment(crypto_invoice(50.0)))
+    
+    assert payment['settlement']['paid_currency'] == "USDT"
+
+def test_settlement_is_written_to_the_paid_invoice(server, chain):
+    chain[("USDT", ADDRESSES["USDT"])] = 50.0
+    
+    async def run():
+        await server.db.invoices.insert_one(crypto_invoice(50.0))
+        payment = await server.detect_invoice_payment(crypto_invoice(50.0))
+        await server.settle_invoice(INVOICE_ID, payment)
+        return await server.db.invoices.find_one({"id": INVOICE_ID}, {"_id": 0})
+    
+    invoice = asyncio.run(run())
+    
+    assert invoice['status'] == "paid"
+    assert invoice['tx_hash'] == "0xusdtpaid"
+    assert (invoice['paid_currency'], invoice['payment_address'], invoice['usd_price']) == ("USDT", ADDRESSES["USDT"], 1.0)
+
+def test_sweep_settles_crypto_invoices(server, chain, monkeypatch):
+    chain[("LTC", ADDRESSES["LTC"])] = 0.5
+    settled = []
+    
+    async def settle_invoice(invoice_id, payment_detected):
+        settled.append((invoice_id, payment_detected['settlement']['paid_currency']))
+        return True
+    
+    monkeypatch.setattr(server, "settle_invoice", settle_invoice)
+    
+    async def run():
+        await server.db.invoices.insert_one(crypto_invoice(50.0))
+        await server.check_pending_payments()
+    
+    asyncio.run(run())
+    
+    assert settled == [(INVOICE_ID, "LTC")]
@@ -0,0 +1,45 @@
+import asyncio
+from datetime import datetime, timezone
+
+ADDRESS = "ltc1qsweepshardtest"
+
+def pending_invoice(invoice_id: str, amount: float) -> dict:
+    return {
+        "id": invoice_id,
+        "staff_id": "staff",
+        "client_id": "client",
+        "currency": "LTC",
+        "payment_address": ADDRESS,
+        "amount": amount,
+        "description": "Sweep test",
+        "status": "pending",
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+def test_sharded_sweep_checks_every_shard_of_a_shared_address(server, monkeypatch):
+    # Ids starting with 0 and 1 fall in shards 0 and 1; the address holds 1 LTC,
+    # so only the shard 1 invoice is payable
+    unpaid = "00000000-0000-4000-8000-000000000000"
+    payable = "10000000-0000-4000-8000-000000000000"
+    settled = []
+    
+    async def check_blockchain_payment(address, currency, amount):
+        return {"detected": True, "tx_hash": "0xpaid"} if amount <= 1 else None
+    
+    async def settle_invoice(invoice_id, payment_detected):
+        settled.append(invoice_id)
+        return True
+    
+    monkeypatch.setattr(server, "SWEEP_SHARDS", 2)
+    monkeypatch.setattr(server, "check_blockchain_payment", check_blockchain_payment)
+    monkeypatch.setattr(server, "settle_invoice", settle_invoice)
+    
+    async def run():
+        await server.db.invoices.insert_many([pending_invoice(unpaid, 100), pending_invoice(payable, 1)])
+        for _ in range(3):
+            await server.check_pending_payments(0)
+            await server.check_pending_payments(1)
+    
+    asyncio.run(run())
+    
+    assert settled == [payable, payable, payable]
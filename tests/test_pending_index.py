@@ -0,0 +1,128 @@
+import asyncio
+import time
+import uuid
+from types import SimpleNamespace
+
+from pending_index import PendingIndex, RecheckSchedule, group_key
+
+ADDRESS = "ltc1qpendingindextest"
+
+def invoice(amount: float = 1.0, address: str = ADDRESS, invoice_id: str = None) -> dict:
+    return {
+        "id": invoice_id or str(uuid.uuid4()),
+        "currency": "LTC",
+        "payment_address": address,
+        "amount": amount,
+        "status": "pending",
+        "created_at": "2026-01-01T00:00:00+00:00"
+    }
+
+def test_bulk_load_of_one_large_group_is_linear():
+    index = PendingIndex()
+    invoices = [invoice() for _ in range(100_000)]
+    
+    started = time.perf_counter()
+    for entry in invoices:
+        index.add(entry, check_duplicates=False)
+    elapsed = time.perf_counter() - started
+    
+    assert index.count == 100_000
+    assert len(index.groups[("LTC", ADDRESS)]) == 100_000
+    assert elapsed < 2.0
+
+def test_incremental_add_rejects_duplicates():
+    index = PendingIndex()
+    entry = invoice()
+    
+    assert index.add(entry)
+    assert not index.add(entry)
+    assert index.count == 1
+
+def test_remove_keeps_remaining_entries():
+    index = PendingIndex()
+    entries = [invoice(amount=i) for i in range(1, 6)]
+    for entry in entries:
+        index.add(entry)
+    
+    assert index.discard(entries[1])
+    assert not index.discard(entries[1])
+    
+    [(_, remaining)] = index.snapshot()
+    assert sorted(remaining) == sorted((e['id'], float(e['amount'])) for e in entries if e is not entries[1])
+    assert index.count == 4
+
+def test_non_uuid_ids_are_ignored():
+    index = PendingIndex()
+    
+    assert not index.add(invoice(invoice_id="not-a-uuid"))
+    assert index.count == 0
+
+def test_multi_currency_invoices_group_by_address_set():
+    crypto = {
+        "id": str(uuid.uuid4()),
+        "currency": "CRYPTO",
+        "payment_addresses": {"USDT": "0xabc", "LTC": ADDRESS},
+        "amount": 10.0
+    }
+    
+    assert group_key(crypto) == ("CRYPTO", (("LTC", ADDRESS), ("USDT", "0xabc")))
+
+def test_refresh_picks_up_invoices_stamped_before_a_local_add(server):
+    async def run():
+        await server.refresh_pending_index()
+        now = server.datetime.now(server.timezone.utc)
+        local = {**invoice(), "created_at": now.isoformat()}
+        await server.db.invoices.insert_one(dict(local))
+        server.pending_index.add(local)
+        # Stamped earlier by another request, committed after the local add
+        late = {**invoice(), "created_at": (now - server.timedelta(milliseconds=200)).isoformat()}
+        await server.db.invoices.insert_one(dict(late))
+        await server.refresh_pending_index()
+    
+    asyncio.run(run())
+    
+    assert server.pending_index.count == 2
+
+def test_stale_invoices_are_due_once_per_interval_and_new_ones_every_sweep():
+    schedule = RecheckSchedule(stale_after=86400, stale_interval=3600, window=120)
+    start = 1_800_000_000.0
+    sweeps = [start + minute * 60 for minute in range(0, 60, 2)]
+    
+    for _ in range(100):
+        key = uuid.uuid4().bytes
+        assert sum(schedule.due(key, start - 10 * 86400, now) for now in sweeps) == 1
+        assert all(schedule.due(key, start - 3600, now) for now in sweeps)
+
+def test_stale_invoices_skip_sweeps_outside_their_window(server, monkeypatch):
+    import pending_index as pending_index_module
+    
+    # Bytes 4-8 of the id are zero, so its window opens on the hour
+    stale = "10000000-0000-4000-8000-000000000000"
+    fresh = "20000000-1111-4000-8000-000000000000"
+    on_the_hour = 1_800_000_000.0
+    clock = {"now": on_the_hour + 1800}
+    checked = []
+    
+    async def check_blockchain_payment(address, currency, amount):
+        checked.append(amount)
+        return None
+    
+    monkeypatch.setattr(server, "check_blockchain_payment", check_blockchain_payment)
+    monkeypatch.setattr(server, "sweep_schedule", RecheckSchedule(86400, 3600, 120))
+    monkeypatch.setattr(pending_index_module, "time", SimpleNamespace(time=lambda: clock["now"], monotonic=time.monotonic))
+    
+    def created(seconds_ago: float) -> str:
+        return server.datetime.fromtimestamp(on_the_hour - seconds_ago, server.timezone.utc).isoformat()
+    
+    async def run():
+        await server.db.invoices.insert_many([
+            {**invoice(100, invoice_id=stale), "created_at": created(10 * 86400)},
+            {**invoice(1, invoice_id=fresh), "created_at": created(60)},
+        ])
+        await server.check_pending_payments()
+        clock["now"] = on_the_hour + 3600 + 60
+        await server.check_pending_payments()
+    
+    asyncio.run(run())
+    
+    assert sorted(checked) == [1, 1, 100]
@@ -0,0 +1,79 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from price_oracle import DEFAULT_FIXTURE_PRICES, FixtureFeed, PriceOracle
+
+def test_fixture_feed_serves_default_or_file_prices(tmp_path):
+    path = tmp_path / "prices.json"
+    path.write_text(json.dumps({"LTC": "90.5"}))
+    
+    assert asyncio.run(FixtureFeed().fetch()) == DEFAULT_FIXTURE_PRICES
+    assert asyncio.run(FixtureFeed(path=str(path)).fetch()) == {"LTC": 90.5}
+
+def test_refreshed_prices_convert_both_ways():
+    oracle = PriceOracle(FixtureFeed({"LTC": 100.0}), max_age_seconds=60)
+    
+    assert asyncio.run(oracle.refresh()) is True
+    assert oracle.to_usd(2, "LTC") == 200.0
+    assert oracle.from_usd(50, "LTC") == 0.5
+    assert oracle.price("USD") == 1.0
+    assert oracle.price("DOGE") is None
+
+def test_prices_past_the_staleness_bound_are_not_served():
+    oracle = PriceOracle(FixtureFeed(), max_age_seconds=60)
+    
+    assert oracle.price("LTC") is None
+    
+    oracle.apply({"LTC": 100.0}, datetime.now(timezone.utc) - timedelta(seconds=61))
+    
+    assert not oracle.is_fresh()
+    assert oracle.price("LTC") is None
+    assert oracle.from_usd(50, "LTC") is None
+    # The quote currency never goes stale
+    assert oracle.price("USD") == 1.0
+
+def test_older_snapshots_do_not_replace_newer_ones():
+    oracle = PriceOracle(FixtureFeed(), max_age_seconds=60)
+    now = datetime.now(timezone.utc)
+    oracle.apply({"LTC": 100.0}, now)
+    
+    oracle.apply({"LTC": 50.0}, now - timedelta(seconds=5))
+    
+    assert oracle.price("LTC") == 100.0
+    assert oracle.fetched_at == now
+
+def test_load_latest_follows_history_and_treats_naive_times_as_utc():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    history = mongomock_motor.AsyncMongoMockClient()["cryptobill_test"].price_history
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    
+    async def run():
+        await history.insert_many([
+            {"fetched_at": (now - timedelta(seconds=30)).replace(tzinfo=None), "prices": {"LTC": 80.0}},
+            {"fetched_at": now.replace(tzinfo=None), "prices": {"LTC": 90.0}},
+        ])
+        oracle = PriceOracle(FixtureFeed(), max_age_seconds=60)
+        loaded = await oracle.load_latest(history)
+        return loaded, oracle
+    
+    loaded, oracle = asyncio.run(run())
+    
+    assert loaded is True
+    assert oracle.fetched_at == now
+    assert oracle.price("LTC") == 90.0
+
+def test_refresh_persists_each_snapshot():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    history = mongomock_motor.AsyncMongoMockClient()["cryptobill_test"].price_history
+    oracle = PriceOracle(FixtureFeed({"LTC": 100.0}), max_age_seconds=60)
+    
+    async def run():
+        await oracle.refresh(history)
+        return await history.find_one({}, {"_id": 0})
+    
+    snapshot = asyncio.run(run())
+    
+    assert (snapshot['source'], snapshot['quote'], snapshot['prices']) == ("fixture", "USD", {"LTC": 100.0})
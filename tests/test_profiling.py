@@ -0,0 +1,36 @@
+import asyncio
+from types import SimpleNamespace
+
+import profiling
+from profiling import RequestProfiler
+
+def debug_request(headers: dict):
+    return SimpleNamespace(headers=headers, method="GET", url=SimpleNamespace(path="/api/invoices"), scope={})
+
+async def call_next(request):
+    return SimpleNamespace(status_code=200)
+
+def profiled(monkeypatch, request, allowed: bool) -> list:
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiling, "profiles", profiling.deque(maxlen=10))
+    asyncio.run(RequestProfiler(lambda request: allowed)(request, call_next))
+    return list(profiling.profiles)
+
+def test_debug_header_is_ignored_for_callers_not_allowed_to_profile(monkeypatch):
+    assert profiled(monkeypatch, debug_request({"x-debug-profile": "stack"}), allowed=False) == []
+
+def test_debug_header_records_a_profile_for_allowed_callers(monkeypatch):
+    [profile] = profiled(monkeypatch, debug_request({"x-debug-profile": "1"}), allowed=True)
+    
+    assert profile['reason'] == "header"
+    assert profile['path'] == "/api/invoices"
+
+def test_only_admin_tokens_may_request_profiles(server):
+    def request_with(role: str):
+        token = server.create_access_token({"sub": f"{role}@example.com", "role": role})
+        return debug_request({"authorization": f"Bearer {token}"})
+    
+    assert server.profile_debug_allowed(request_with("admin"))
+    assert not server.profile_debug_allowed(request_with("client"))
+    assert not server.profile_debug_allowed(debug_request({"authorization": "Bearer not-a-token"}))
+    assert not server.profile_debug_allowed(debug_request({}))
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+import query_budget
+from query_budget import InstrumentedDatabase, QueryBudgetExceeded, enforce_query_budget, query_shape
+
+def test_query_shape_keeps_fields_and_operators_but_not_values():
+    assert query_shape({"id": "abc", "amount": {"$gte": 5}, "tags": ["a", "b"]}) == "{id:?,amount:{$gte:?},tags:[?]}"
+    assert query_shape([{"$match": {"status": "paid"}}]) == "[{$match:{status:?}}]"
+
+def budget_request(budget: int):
+    async def endpoint():
+        pass
+    endpoint.query_budget = budget
+    return SimpleNamespace(method="GET", url=SimpleNamespace(path="/api/invoices"), scope={"endpoint": endpoint})
+
+def handler(*shapes):
+    # Records one query per shape, the way InstrumentedCollection does
+    async def call_next(request):
+        for shape in shapes:
+            query_budget.record_query("invoices", "find_one", shape, 0.0)
+        return SimpleNamespace(headers={})
+    return call_next
+
+def test_queries_within_budget_are_reported_in_headers(caplog):
+    with caplog.at_level(logging.WARNING):
+        response = asyncio.run(enforce_query_budget(budget_request(2), handler({"id": "a"}, {"email": "b"})))
+    
+    assert response.headers["X-DB-Queries"] == "2"
+    assert caplog.records == []
+
+def test_over_budget_is_logged(caplog):
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(enforce_query_budget(budget_request(1), handler({"id": "a"}, {"email": "b"})))
+    
+    assert "2 queries (budget 1)" in caplog.text
+
+def test_over_budget_fails_the_request_when_strict(monkeypatch):
+    monkeypatch.setattr(query_budget, "QUERY_BUDGET_STRICT", True)
+    
+    with pytest.raises(QueryBudgetExceeded, match="budget 1"):
+        asyncio.run(enforce_query_budget(budget_request(1), handler({"id": "a"}, {"email": "b"})))
+
+def test_repeated_query_shape_is_flagged_within_budget(caplog):
+    shapes = [{"id": str(n)} for n in range(query_budget.QUERY_REPEAT_THRESHOLD)]
+    
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(enforce_query_budget(budget_request(10), handler(*shapes)))
+    
+    assert "repeated query shapes ['invoices.find_one{id:?}']" in caplog.text
+
+def test_instrumented_collections_count_each_round_trip():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = InstrumentedDatabase(mongomock_motor.AsyncMongoMockClient()["cryptobill_test"])
+    
+    async def run():
+        trace = query_budget.QueryTrace()
+        token = query_budget.current_trace.set(trace)
+        try:
+            await database.invoices.insert_one({"id": "a", "status": "pending"})
+            await database.invoices.find_one({"id": "a"})
+            await database.invoices.find({"status": "pending"}).sort("id", 1).to_list(10)
+        finally:
+            query_budget.current_trace.reset(token)
+        return trace
+    
+    trace = asyncio.run(run())
+    
+    assert trace.count == 3
+    assert {"invoices.find_one{id:?}", "invoices.find{status:?}"} <= set(trace.shapes)
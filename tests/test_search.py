@@ -0,0 +1,83 @@
+import asyncio
+import re
+
+from search import MAX_QUERY_WORDS, prefix_filter, query_words, search_terms
+
+def test_email_is_kept_as_one_term_next_to_its_words():
+    assert search_terms("Ada Lovelace", "Ada.Lovelace@Example.com") == [
+        "ada", "lovelace", "ada.lovelace@example.com", "example", "com"
+    ]
+
+def test_query_with_an_email_searches_for_the_whole_address():
+    assert query_words("  Ada.Lovelace@Example ") == ["ada.lovelace@example"]
+
+def test_every_query_word_must_prefix_match():
+    terms = prefix_filter("Ada Love")["search_terms"]["$all"]
+    
+    assert [pattern.pattern for pattern in terms] == ["^ada", "^love"]
+
+def test_regex_metacharacters_are_escaped():
+    [pattern] = prefix_filter("a.b@c+d")["search_terms"]["$all"]
+    
+    assert pattern.match("a.b@c+d.com")
+    assert not pattern.match("axb@c+d.com")
+    assert not pattern.match("a.b@cccd.com")
+
+def test_query_words_are_capped():
+    words = query_words(" ".join(f"word{i}" for i in range(MAX_QUERY_WORDS + 4)))
+    
+    assert len(words) == MAX_QUERY_WORDS
+    assert words[-1] == f"word{MAX_QUERY_WORDS - 1}"
+
+def test_query_without_words_searches_nothing():
+    assert prefix_filter(" -- ") is None
+
+class RecordingCollection:
+    def __init__(self, queries: dict, name: str):
+        self.queries = queries
+        self.name = name
+    
+    def find(self, query, projection=None):
+        self.queries[self.name] = query
+        return self
+    
+    def limit(self, limit):
+        return self
+    
+    async def to_list(self, length):
+        return []
+
+class RecordingDatabase:
+    def __init__(self):
+        self.queries = {}
+    
+    def __getattr__(self, name):
+        return RecordingCollection(self.queries, name)
+
+def search_queries(server, monkeypatch, user, q: str = "ada") -> dict:
+    database = RecordingDatabase()
+    monkeypatch.setattr(server, "analytics_db", database)
+    asyncio.run(server.search(q, user))
+    return database.queries
+
+def test_search_is_scoped_to_the_callers_invoices(server, monkeypatch):
+    client = server.User(id="client", email="client@example.com", full_name="Client", role="client")
+    staff = server.User(id="staff", email="staff@example.com", full_name="Staff", role="staff")
+    admin = server.User(id="admin", email="admin@example.com", full_name="Admin", role="admin")
+    terms = prefix_filter("ada")
+    
+    assert search_queries(server, monkeypatch, client) == {"invoices": {"$and": [terms, {"client_id": "client"}]}}
+    assert search_queries(server, monkeypatch, staff) == {"invoices": {"$and": [terms, {"staff_id": "staff"}]}}
+    assert search_queries(server, monkeypatch, admin) == {
+        "invoices": terms,
+        "users": {**terms, "role": "client"},
+        "staff": {**terms, "active": True}
+    }
+
+def test_long_single_word_also_matches_tx_hash_prefixes(server, monkeypatch):
+    admin = server.User(id="admin", email="admin@example.com", full_name="Admin", role="admin")
+    q = "0x" + "ab" * server.TX_HASH_MIN_PREFIX
+    
+    invoice_query = search_queries(server, monkeypatch, admin, q)["invoices"]
+    
+    assert invoice_query == {"$or": [prefix_filter(q), {"tx_hash": {"$regex": "^" + re.escape(q)}}]}